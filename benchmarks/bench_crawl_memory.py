@@ -0,0 +1,130 @@
+"""Peak RSS of cleaning one crawled page, for the original and current pipelines.
+
+Each measurement runs in a fresh process, so every peak is its own. Pages
+are built before the baseline is taken: the figures are what the cleaning
+pipeline adds on top of the page the browser (or the network) hands over.
+
+    legacy  - regex strip_html_tags, remove_unicode and an encoding truncate, all on the whole page
+    browser - a rendered page cleaned by _clean_crawl_result
+    http    - a plain GET from a local server through _crawl_and_clean(mode="http")
+
+Cleaning runs in a thread here (MCP_CLEAN_WORKERS processes would hold it instead).
+Run from the repository root:
+
+    python benchmarks/bench_crawl_memory.py [size_mb] [concurrency]
+"""
+import asyncio
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+from bench_html_to_text import legacy_strip_html_tags, typical_page  # noqa: E402
+from main import remove_unicode  # noqa: E402
+
+SCENARIOS = ("legacy", "browser", "http")
+
+
+# The truncate that encoded the whole text before cutting it
+def legacy_truncate(text, max_bytes):
+    encoded = text.encode("utf-8")
+    if len(encoded) <= max_bytes:
+        return text
+    return encoded[:max_bytes].decode("utf-8", errors="ignore") + "\n...[truncated]"
+
+
+class RenderedPage:
+    success = True
+    extracted_content = None
+    response_headers = {}
+
+    def __init__(self, html):
+        self.html = html
+
+
+def serve(body: bytes) -> ThreadingHTTPServer:
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def peak_rss_kb() -> int:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+async def crawl(scenario: str, page: str, url: str, budget: int) -> int:
+    if scenario == "legacy":
+        text = await asyncio.to_thread(lambda: legacy_truncate(remove_unicode(legacy_strip_html_tags(page)).strip(), budget))
+    elif scenario == "browser":
+        text, _ = await main._clean_crawl_result(url, RenderedPage(page), budget)
+    else:
+        text, _ = await main._crawl_and_clean(url, budget, mode="http")
+    return len(text)
+
+
+def child(scenario: str, size_mb: float, concurrency: int) -> None:
+    """Run concurrency crawls at once and print: peak RSS before, after, and cleaned characters."""
+    with tempfile.TemporaryDirectory() as tmp:
+        main.CACHE_DB_FILE = os.path.join(tmp, "cache.sqlite3")
+        budget = main.CRAWL_DOCUMENT_MAX_BYTES
+        size = int(size_mb * 1_000_000)
+        if scenario == "http":
+            server = serve(typical_page(size).encode("utf-8"))
+            pages = [""] * concurrency
+            urls = [f"http://127.0.0.1:{server.server_address[1]}/page{i}" for i in range(concurrency)]
+        else:
+            pages = [typical_page(size + i) for i in range(concurrency)]
+            urls = [f"https://example.com/page{i}" for i in range(concurrency)]
+        before = peak_rss_kb()
+
+        async def run():
+            return await asyncio.gather(*(crawl(scenario, page, url, budget) for page, url in zip(pages, urls)))
+
+        cleaned = asyncio.run(run())
+        print(before, peak_rss_kb(), sum(cleaned))
+
+
+def measure(scenario: str, size_mb: float, concurrency: int) -> tuple[float, float, int]:
+    out = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--child", scenario, str(size_mb), str(concurrency)],
+        capture_output=True, text=True, check=True,
+    ).stdout.split()
+    before, after, cleaned = (int(value) for value in out[-3:])
+    return after / 1024, (after - before) / 1024, cleaned
+
+
+def main_() -> None:
+    size_mb = float(sys.argv[1]) if len(sys.argv) > 1 else 8.0
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    print(f"page size {size_mb:.1f} MB, CRAWL_MAX_PAGE_BYTES {main.CRAWL_MAX_PAGE_BYTES / 1e6:.1f} MB, "
+          f"CRAWL_SPOOL_BYTES {main.CRAWL_SPOOL_BYTES / 1e6:.1f} MB")
+    for crawls in sorted({1, concurrency}):
+        print(f"{crawls} concurrent crawl(s):")
+        for scenario in SCENARIOS:
+            peak, added, cleaned = measure(scenario, size_mb, crawls)
+            print(f"  {scenario:8}: peak RSS {peak:7.1f} MB, {added / crawls:7.1f} MB per crawl "
+                  f"({cleaned / crawls / 1e6:.1f} MB of text each)")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "--child":
+        child(sys.argv[2], float(sys.argv[3]), int(sys.argv[4]))
+    else:
+        main_()
@@ -0,0 +1,93 @@
+"""Compare the streaming HTML-to-text engine with the original regex strip_html_tags.
+
+Run from the repository root:
+
+    python benchmarks/bench_html_to_text.py [size_mb]
+"""
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import clean_and_truncate, iter_html_text, remove_unicode, strip_html_tags, truncate  # noqa: E402
+
+
+# The four-pass implementation strip_html_tags replaced
+def legacy_strip_html_tags(html):
+    html = re.sub(r'(?is)<(script|style).*?>.*?(</\1>)', '', html)
+    html = re.sub(r'<[^>]+>', '', html)
+    html = re.sub(r'&[a-zA-Z]+;', ' ', html)
+    html = re.sub(r'\s+', ' ', html)
+    return html.strip()
+
+
+BLOCK = """
+<div class="post"><h2>Section title &amp; subtitle</h2>
+<p>Lorem ipsum <a href="/x?a=1&amp;b=2">dolor</a> sit amet, <b>consectetur</b> adipiscing elit &mdash;
+sed do eiusmod tempor incididunt ut labore et dolore magna aliqua.&nbsp;Ut enim ad minim veniam.</p>
+<script type="text/javascript">var data = {"a": [1, 2, 3], "html": "<div>not text</div>"};</script>
+<style>.post p { margin: 0 } .post h2 { font-weight: bold }</style>
+<ul><li>One</li><li>Two</li><li>Three &#8212; with an entity</li></ul>
+<!-- a comment with <tags> inside -->
+</div>
+"""
+
+
+def typical_page(size: int) -> str:
+    body = BLOCK * (size // len(BLOCK) + 1)
+    return f"<!DOCTYPE html><html><head><title>Bench</title></head><body>{body}</body></html>"
+
+
+def malformed_page(size: int) -> str:
+    # Unclosed <script> openers make the legacy lazy regex rescan the rest of the page each time
+    return ("<script>x " + "lorem ipsum " * 8) * (size // 106 + 1)
+
+
+def best_of(fn, *args, repeat: int = 3) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def stream_first_bytes(html: str, budget: int) -> str:
+    produced = []
+    total = 0
+    for piece in iter_html_text(html):
+        produced.append(piece)
+        total += len(piece)
+        if total >= budget:
+            break
+    return "".join(produced)
+
+
+def legacy_pipeline(html: str, budget: int) -> str:
+    cleaned = remove_unicode(legacy_strip_html_tags(html)).strip()
+    return truncate(cleaned, budget)
+
+
+def main() -> None:
+    size_mb = float(sys.argv[1]) if len(sys.argv) > 1 else 4.0
+    page = typical_page(int(size_mb * 1_000_000))
+    print(f"typical page: {len(page) / 1e6:.1f} MB")
+    print(f"  legacy regex strip_html_tags : {best_of(legacy_strip_html_tags, page):8.3f}s")
+    print(f"  streaming strip_html_tags    : {best_of(strip_html_tags, page):8.3f}s")
+    print(f"  streaming, stop at 300 KB    : {best_of(stream_first_bytes, page, 300_000):8.3f}s")
+    for budget in (300_000, 3000):
+        print(f"crawl cleaning pipeline, {budget} byte budget:")
+        print(f"  legacy clean-then-truncate   : {best_of(legacy_pipeline, page, budget):8.3f}s")
+        print(f"  clean_and_truncate           : {best_of(clean_and_truncate, page, budget):8.3f}s")
+
+    for size in (20_000, 40_000):
+        bad = malformed_page(size)
+        print(f"malformed page: {len(bad) / 1e3:.0f} KB")
+        print(f"  legacy regex strip_html_tags : {best_of(legacy_strip_html_tags, bad, repeat=1):8.3f}s")
+        print(f"  streaming strip_html_tags    : {best_of(strip_html_tags, bad, repeat=1):8.3f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,526 @@
+"""HTML-to-text cleaning for the crawl tools in main.py.
+
+Standard library only: the cleaning worker processes import this module,
+so each of them stays small instead of loading crawl4ai, mcp and PIL.
+"""
+import html as htmllib
+import os
+import re
+import tempfile
+from html.parser import HTMLParser
+from typing import Callable, Iterable, Iterator
+
+MAX_RESULT_BYTES = 300_000 #instead oi 1_000_000 
+
+# remove non-unicode characters
+def remove_unicode(text: str) -> str:
+    """Remove non-ASCII characters from a string."""
+    return re.sub(r'[^\x00-\x7F]+', '', text)
+
+# Elements whose content is never visible text
+_SKIPPED_ELEMENTS = ("script", "style", "noscript", "template")
+# Elements that separate words even when the markup has no whitespace around them,
+# grouped by first letter because the regex engine tries alternatives one by one
+_BLOCK_ELEMENTS = (
+    "a(?:ddress|rticle|side)|b(?:lockquote|r)|d(?:[dlt]|iv)|f(?:ieldset|igcaption|igure|ooter|orm)"
+    "|h(?:[1-6r]|eader)|li|main|nav|o(?:l|ption)|p(?:re)?|section"
+    "|t(?:able|body|[dhr]|foot|head|itle)|ul"
+)
+_SKIP_START_RE = re.compile(rf"<!--|<({'|'.join(_SKIPPED_ELEMENTS)})\b", re.IGNORECASE)
+_SKIP_END_RE = {name: re.compile(rf"</{name}\s*>", re.IGNORECASE) for name in _SKIPPED_ELEMENTS}
+_COMMENT_END_RE = re.compile("-->")
+_BLOCK_TAG_RE = re.compile(rf"</?(?:{_BLOCK_ELEMENTS})\b[^>]*>", re.IGNORECASE)
+_ANY_TAG_RE = re.compile(r"<[/!?]?[A-Za-z][^>]*>")
+# The tail of tag-free text that html.unescape() could still read as the start of a reference
+_PARTIAL_ENTITY_RE = re.compile(r"&(?:#[0-9]{0,32}|#[xX][0-9a-fA-F]{0,32}|[^\t\n\f <&#;]{0,32})\Z")
+# An unterminated tag longer than this is treated as literal text rather than buffered forever
+_MAX_TAG_BYTES = 65_536
+
+
+class HTMLTextExtractor:
+    """Turn HTML into whitespace-collapsed visible text, chunk by chunk.
+
+    A single forward scan splits the input into visible markup and skipped
+    regions (comments and script/style/noscript/template content), using
+    plain searches so malformed pages stay linear. Visible markup is
+    cleaned in bulk: block tags become spaces, other tags are dropped,
+    entities are decoded and whitespace is collapsed.
+
+    feed() and close() return the text produced so far, so callers can
+    stream output (and stop early) without holding the whole document.
+    Anything the next chunk could still change (an unclosed tag, a partial
+    entity) is held back, so the output does not depend on the chunking.
+    """
+
+    def __init__(self):
+        self._buffer = ""
+        self._skip_until: re.Pattern | None = None
+        self._started = False
+        self._pending_space = False
+        self._pending_markup = ""
+        self._pending_text = ""
+
+    def feed(self, chunk: str) -> str:
+        self._buffer += chunk
+        return self._parse(final=False)
+
+    def close(self) -> str:
+        return self._parse(final=True)
+
+    def _parse(self, final: bool) -> str:
+        buf = self._buffer
+        n = len(buf)
+        pos = 0
+        visible: list[str] = []
+        open_end = False
+        while pos < n:
+            if self._skip_until is not None:
+                match = self._skip_until.search(buf, pos)
+                if match is None:
+                    # Only the tail can hold the start of a split end marker
+                    pos = n if final else max(pos, n - 16)
+                    break
+                pos = match.end()
+                self._skip_until = None
+                continue
+
+            match = _SKIP_START_RE.search(buf, pos)
+            if match is None:
+                end = n if final else self._unmatched_lt(buf, pos)
+                visible.append(buf[pos:end])
+                open_end = not final
+                pos = end
+                break
+            visible.append(buf[pos:match.start()])
+            if match.group(1) is None:
+                self._skip_until = _COMMENT_END_RE
+                pos = match.end()
+                continue
+            gt = buf.find(">", match.end())
+            if gt == -1:
+                if not final and n - match.start() <= _MAX_TAG_BYTES:
+                    pos = match.start()  # wait for the rest of the opening tag
+                    break
+                gt = n - 1
+            if buf[gt - 1] != "/":
+                self._skip_until = _SKIP_END_RE[match.group(1).lower()]
+            pos = gt + 1
+        self._buffer = buf[pos:]
+        if final:
+            visible.append("")  # flush what the previous feed() held back
+        # Each stretch of markup between skipped regions is rendered on its own, so a
+        # stray "<" never pairs with a ">" beyond a script or comment. A stretch cut by
+        # feed() keeps back whatever the next chunk could still change: block tags go
+        # first, so a stray "<" can pair with a ">" that only follows one ("x<y<p>>")...
+        pieces = []
+        for markup in visible:
+            pieces.append(self._pending_markup + _BLOCK_TAG_RE.sub(" ", markup))
+            self._pending_markup = ""
+        if open_end:
+            cut = self._unmatched_lt(pieces[-1], 0)
+            self._pending_markup = pieces[-1][cut:]
+            pieces[-1] = pieces[-1][:cut]
+        # ...and an entity can run on across an inline tag ("&am</b>p;")
+        for i, markup in enumerate(pieces):
+            pieces[i] = self._pending_text + _ANY_TAG_RE.sub("", markup)
+            self._pending_text = ""
+        if open_end:
+            match = _PARTIAL_ENTITY_RE.search(pieces[-1])
+            if match:
+                self._pending_text = match.group()
+                pieces[-1] = pieces[-1][:match.start()]
+        return "".join([self._render(text) for text in pieces])
+
+    @staticmethod
+    def _unmatched_lt(text: str, pos: int) -> int:
+        """Where the first "<" without a ">" after it starts, or len(text).
+
+        A "<" more than _MAX_TAG_BYTES from the end is taken as literal text.
+        """
+        end = len(text)
+        lt = text.find("<", max(text.rfind(">", pos) + 1, pos, end - _MAX_TAG_BYTES))
+        return end if lt == -1 else lt
+
+    def _render(self, text: str) -> str:
+        if not text:
+            return ""
+        if "&" in text:
+            text = htmllib.unescape(text)
+        # split()/join collapses whitespace runs far faster than a regex substitution
+        words = text.split()
+        if not words:
+            self._pending_space = self._pending_space or bool(text)
+            return ""
+        lead = " " if self._started and (self._pending_space or text[0].isspace()) else ""
+        self._started = True
+        self._pending_space = text[-1].isspace()
+        return lead + " ".join(words)
+
+
+def iter_html_text(html: str | Iterable[str], chunk_size: int = 65_536) -> Iterator[str]:
+    """Yield visible text from HTML given as one string or an iterable of chunks."""
+    if isinstance(html, str):
+        document = html
+        chunks: Iterable[str] = (document[i:i + chunk_size] for i in range(0, len(document), chunk_size))
+    else:
+        chunks = html
+    extractor = HTMLTextExtractor()
+    for chunk in chunks:
+        text = extractor.feed(chunk)
+        if text:
+            yield text
+    text = extractor.close()
+    if text:
+        yield text
+
+# strip HTML tags
+def strip_html_tags(html: str) -> str:
+    """Return the visible text of an HTML document, with entities decoded and whitespace collapsed."""
+    return "".join(iter_html_text(html))
+    
+#truncate text
+def truncate(text: str, max_bytes: int = MAX_RESULT_BYTES) -> str:
+    """Truncate a string to fit within a byte limit, without splitting a UTF-8 character."""
+    if text.isascii():
+        return text if len(text) <= max_bytes else text[:max_bytes] + "\n...[truncated]"
+    # Every character takes at least one byte, so never encode more than max_bytes + 1 of them
+    encoded = text[:max_bytes + 1].encode("utf-8")
+    if len(encoded) <= max_bytes:
+        return text
+    return encoded[:max_bytes].decode("utf-8", errors="ignore") + "\n...[truncated]"
+
+# clean crawled HTML within a byte budget
+def clean_and_truncate(content: str | Iterable[str], max_bytes: int = MAX_RESULT_BYTES,
+                       on_text: Callable[[str], None] | None = None, batch_bytes: int = 65_536) -> str:
+    """strip_html_tags -> remove_unicode -> strip -> truncate, fused into one streaming pass.
+
+    Parsing stops as soon as more than max_bytes of cleaned text exist, so
+    a long page costs about as much as its first max_bytes of content, and
+    the pieces are cut to size before they are joined, so the result is the
+    only full-size copy of the text ever made.
+
+    With on_text, the text is also handed over as it is produced, at least
+    batch_bytes at a time. The newest piece and trailing whitespace are kept
+    back until more text follows, so the batches always add up to a prefix
+    of the result; the rest is only in the return value.
+    """
+    pieces: list[str] = []
+    size = 0
+    unsent: list[str] = []
+    unsent_size = 0
+    held = ""  # whitespace at the end of the last batch
+    for piece in iter_html_text(content):
+        piece = remove_unicode(piece)
+        if not pieces:
+            piece = piece.lstrip()
+            if not piece:
+                continue
+        pieces.append(piece)
+        size += len(piece)  # ASCII only after remove_unicode, so characters == bytes
+        if on_text is not None:
+            unsent.append(piece)
+            unsent_size += len(piece)
+            # Whatever fits within max_bytes is never cut, so everything but the newest piece can go
+            if size <= max_bytes and unsent_size - len(piece) >= batch_bytes:
+                batch = held + "".join(unsent[:-1])
+                text = batch.rstrip()
+                held = batch[len(text):]
+                unsent, unsent_size = unsent[-1:], len(piece)
+                if text:
+                    on_text(text)
+        if size > max_bytes:
+            # Trailing whitespace would be stripped, so only stop once real text overflows
+            size = _rstrip_pieces(pieces, size)
+            if size > max_bytes:
+                while size - len(pieces[-1]) > max_bytes:
+                    size -= len(pieces.pop())
+                pieces[-1] = pieces[-1][:len(pieces[-1]) - (size - max_bytes)]
+                return "".join(pieces) + "\n...[truncated]"
+    _rstrip_pieces(pieces, size)
+    return "".join(pieces)
+
+def _rstrip_pieces(pieces: list[str], size: int) -> int:
+    """Strip trailing whitespace off a list of text pieces in place and return their new total size."""
+    while pieces:
+        last = pieces[-1].rstrip()
+        size -= len(pieces[-1]) - len(last)
+        if last:
+            pieces[-1] = last
+            break
+        pieces.pop()
+    return size
+
+
+# Readability-style hints in class/id attributes
+_UNLIKELY_RE = re.compile(
+    r"-ad-|ad-break|agegate|banner|breadcrumb|combx|comment|community|consent|cookie|cover-wrap|disqus"
+    r"|extra|footer|gdpr|legends|menu|modal|newsletter|pager|pagination|popup|related|remark|replies"
+    r"|rss|share|shoutbox|sidebar|skyscraper|social|sponsor|subscribe|supplemental|widget",
+    re.IGNORECASE,
+)
+_MAYBE_CANDIDATE_RE = re.compile(r"and|article|body|column|content|main|shadow", re.IGNORECASE)
+_POSITIVE_RE = re.compile(r"article|body|content|entry|hentry|h-entry|main|page|post|text|blog|story", re.IGNORECASE)
+_NEGATIVE_RE = re.compile(
+    r"-ad-|hidden|banner|combx|comment|com-|contact|foot|masthead|media|meta|outbrain|promo|related"
+    r"|scroll|share|shoutbox|sidebar|skyscraper|sponsor|shopping|tags|tool|widget",
+    re.IGNORECASE,
+)
+# Dropped with everything inside them, wherever they appear
+_BOILERPLATE_ELEMENTS = frozenset(_SKIPPED_ELEMENTS + (
+    "aside", "button", "dialog", "footer", "form", "iframe", "nav", "select", "svg",
+))
+_VOID_ELEMENTS = frozenset((
+    "area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "param", "source", "track", "wbr",
+))
+# Text in these counts as a paragraph for scoring
+_PARAGRAPH_ELEMENTS = frozenset(("p", "pre", "td", "blockquote"))
+_BLOCK_ELEMENT_NAMES = frozenset((
+    "address", "article", "blockquote", "div", "dl", "figure", "h1", "h2", "h3", "h4", "h5", "h6",
+    "header", "li", "main", "ol", "p", "pre", "section", "table", "ul",
+))
+# Starting score by element, as in Readability; HTML5 article/main get a bonus for their semantics
+_TAG_WEIGHTS = {
+    "article": 10, "main": 10, "div": 5, "pre": 3, "td": 3, "blockquote": 3,
+    "address": -3, "ol": -3, "ul": -3, "dl": -3, "dd": -3, "dt": -3, "li": -3, "form": -3,
+    "h1": -5, "h2": -5, "h3": -5, "h4": -5, "h5": -5, "h6": -5, "th": -5,
+}
+
+class _ContentNode:
+    __slots__ = ("tag", "hints", "start", "end", "parent", "children", "text_len", "link_len",
+                 "commas", "has_block", "score", "candidate")
+
+    def __init__(self, tag: str, hints: str, start: int, parent: "_ContentNode | None"):
+        self.tag = tag
+        self.hints = hints
+        self.start = start
+        self.end = start
+        self.parent = parent
+        self.children: list[_ContentNode] = []
+        self.text_len = 0
+        self.link_len = 0
+        self.commas = 0
+        self.has_block = False
+        self.score = 0.0
+        self.candidate = False
+
+class MainContentScorer(HTMLParser):
+    """Find the main article of a page the way Readability does, in one pass over the HTML.
+
+    Paragraph-like elements score 1 point, plus one per comma and one per 100
+    characters (up to 3). The score goes to the parent, and half of it to the
+    grandparent. Candidates start from a weight for their tag and class/id
+    hints, and their score is scaled by (1 - link density) at the end.
+    Boilerplate elements (nav, footer, aside, forms, "unlikely" class names)
+    are cut out. The result is a list of HTML slices that the usual cleaning
+    pipeline turns into text.
+    """
+
+    def __init__(self, html: str):
+        super().__init__(convert_charrefs=True)
+        self.html = html
+        self._line_starts = [0] + [m.end() for m in re.finditer("\n", html)]
+        self.root = _ContentNode("#root", "", 0, None)
+        self._stack = [self.root]
+        self._skip_depth = 0
+        self._link_depth = 0
+        self.removed: list[tuple[int, int]] = []
+        self.candidates: list[_ContentNode] = []
+
+    def _offset(self) -> int:
+        line, column = self.getpos()
+        return self._line_starts[line - 1] + column
+
+    def handle_starttag(self, tag: str, attrs: list[tuple[str, str | None]]) -> None:
+        if tag in _VOID_ELEMENTS:
+            return
+        start = self._offset()
+        top = self._stack[-1]
+        # Implied end tags: <p> cannot contain blocks, and a new <li> closes the previous one
+        if (top.tag == "p" and tag in _BLOCK_ELEMENT_NAMES) or (top.tag == "li" and tag == "li"):
+            self._close(len(self._stack) - 1, start)
+            top = self._stack[-1]
+        values = dict(attrs)
+        hints = f"{values.get('class') or ''} {values.get('id') or ''}"
+        node = _ContentNode(tag, hints, start, top)
+        top.children.append(node)
+        self._stack.append(node)
+        removed = tag in _BOILERPLATE_ELEMENTS or (
+            tag not in ("html", "body", "article", "main", "a")
+            and _UNLIKELY_RE.search(hints) is not None
+            and _MAYBE_CANDIDATE_RE.search(hints) is None
+        )
+        if removed or self._skip_depth:
+            self._skip_depth += 1
+        elif tag == "a":
+            self._link_depth += 1
+
+    def handle_endtag(self, tag: str) -> None:
+        for depth in range(len(self._stack) - 1, 0, -1):
+            if self._stack[depth].tag == tag:
+                position = self._offset()
+                end = self.html.find(">", position)
+                self._close(depth, len(self.html) if end < 0 else end + 1)
+                return
+
+    def handle_data(self, data: str) -> None:
+        if self._skip_depth:
+            return
+        size = len(" ".join(data.split()))
+        node = self._stack[-1]
+        node.text_len += size
+        node.commas += data.count(",")
+        if self._link_depth:
+            node.link_len += size
+
+    def close(self) -> None:
+        super().close()
+        if len(self._stack) > 1:
+            self._close(1, len(self.html))
+
+    def _close(self, depth: int, end: int) -> None:
+        """Close the elements at stack positions depth and above, innermost first."""
+        while len(self._stack) > depth:
+            node = self._stack.pop()
+            node.end = end
+            if self._skip_depth:
+                self._skip_depth -= 1
+                if not self._skip_depth:
+                    self.removed.append((node.start, end))
+                continue
+            if node.tag == "a":
+                self._link_depth -= 1
+            parent = node.parent
+            parent.text_len += node.text_len
+            parent.link_len += node.link_len
+            parent.commas += node.commas
+            parent.has_block = parent.has_block or node.has_block or node.tag in _BLOCK_ELEMENT_NAMES
+            paragraph = node.tag in _PARAGRAPH_ELEMENTS or (node.tag in ("div", "section") and not node.has_block)
+            if paragraph and node.text_len >= 25:
+                score = 1 + node.commas + min(node.text_len // 100, 3)
+                self._credit(parent, score)
+                if parent.parent is not None:
+                    self._credit(parent.parent, score / 2)
+
+    def _credit(self, node: _ContentNode, score: float) -> None:
+        if node is self.root:
+            return
+        if not node.candidate:
+            node.candidate = True
+            node.score = _TAG_WEIGHTS.get(node.tag, 0)
+            if _POSITIVE_RE.search(node.hints):
+                node.score += 25
+            if _NEGATIVE_RE.search(node.hints):
+                node.score -= 25
+            self.candidates.append(node)
+        node.score += score
+
+def _final_score(node: _ContentNode) -> float:
+    link_density = node.link_len / node.text_len if node.text_len else 1.0
+    return node.score * (1 - link_density)
+
+def main_content_segments(html: str, min_text: int = 200) -> list[str] | None:
+    """HTML slices holding a page's main content, or None when no clear article is found."""
+    scorer = MainContentScorer(html)
+    scorer.feed(html)
+    scorer.close()
+    if not scorer.candidates:
+        return None
+    top = max(scorer.candidates, key=_final_score)
+    if top.text_len < min_text:
+        return None
+
+    # Related siblings (e.g. the article's lead paragraph outside its wrapper) join the top candidate
+    top_score = _final_score(top)
+    threshold = max(10.0, top_score * 0.2)
+    selected = []
+    for sibling in top.parent.children if top.parent is not scorer.root else [top]:
+        if sibling is top or (sibling.candidate and _final_score(sibling) >= threshold):
+            selected.append(sibling)
+        elif sibling.tag == "p" and sibling.text_len > 80 and sibling.link_len < sibling.text_len * 0.25:
+            selected.append(sibling)
+
+    segments: list[str] = []
+    removed = iter(scorer.removed)
+    cut = next(removed, None)
+    for node in selected:
+        position = node.start
+        while cut is not None and cut[0] < node.end:
+            if cut[1] > position:
+                segments.append(html[position:max(position, cut[0])])
+                position = cut[1]
+            cut = next(removed, None)
+        segments.append(html[position:node.end])
+    return [segment for segment in segments if segment]
+
+def clean_main_content(html: "str | SpooledPage", max_bytes: int = MAX_RESULT_BYTES,
+                       on_text: Callable[[str], None] | None = None, batch_bytes: int = 65_536) -> str:
+    """Like clean_and_truncate, but keep only the page's main content when one stands out.
+    Text reaches on_text only once the whole page has been scored."""
+    if not isinstance(html, str):
+        # Scoring needs the whole page; a spooled one is read only here, in the cleaning worker
+        html = html.read()
+    segments = main_content_segments(html)
+    # Separate slices so text either side of a removed element does not run together
+    return clean_and_truncate(html if segments is None else (f"{segment}\n" for segment in segments), max_bytes,
+                              on_text, batch_bytes)
+
+class SpooledPage:
+    """A downloaded page body kept in a temporary file (in directory) instead of in memory.
+
+    Iterating yields the text in chunks, so clean_and_truncate reads it like
+    any other chunked HTML. Pickled copies (in cleaning workers) carry only
+    the path; the file is deleted by close() on the instance that created it.
+    truncated is set when the page was cut at a size cap while spooling.
+    """
+
+    def __init__(self, path: str | None = None, size: int = 0, directory: str | None = None):
+        self._owner = path is None
+        if path is None:
+            fd, path = tempfile.mkstemp(prefix="mcp-crawl-", suffix=".html", dir=directory)
+            os.close(fd)
+        self.path = path
+        self.size = size
+        self.truncated = False
+        self._writer = None
+
+    def write(self, text: str) -> None:
+        if self._writer is None:
+            self._writer = open(self.path, "w", encoding="utf-8", errors="replace", newline="")
+        self._writer.write(text)
+        self.size += len(text)
+
+    def finish(self) -> None:
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __iter__(self) -> Iterator[str]:
+        with open(self.path, encoding="utf-8", newline="") as f:
+            while chunk := f.read(65_536):
+                yield chunk
+
+    def read(self) -> str:
+        with open(self.path, encoding="utf-8", newline="") as f:
+            return f.read()
+
+    def close(self) -> None:
+        self.finish()
+        if self._owner:
+            self._owner = False
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
+
+    def __reduce__(self):
+        # A copy that does not own the file
+        return type(self), (self.path, self.size)
@@ -1,5 +1,6 @@
 # server.py
 from mcp.server.fastmcp import FastMCP, Context, Image
+from mcp.types import SamplingMessage, TextContent
 from crawl4ai import *
 from PIL import Image as PILImage
 
@@ -8,18 +9,704 @@ import httpx  # Add this at the top
 import re
 import sys
 import json
+import asyncio
+import base64
+import concurrent.futures
+import difflib
+import hashlib
+import html as htmllib
+import importlib.util
+import io
+import multiprocessing
+import sqlite3
+import struct
+import time
+import unicodedata
+import zlib
+from collections import OrderedDict
+from contextlib import asynccontextmanager, closing
+from email.utils import parsedate_to_datetime
+from typing import Any, AsyncIterator, Awaitable, Callable, Iterable, Iterator
+from urllib.parse import urljoin, urlsplit, urlunsplit
+
+# Page cleaning lives in its own stdlib-only module, which the cleaning worker processes import
+from html_cleaning import (
+    MAX_RESULT_BYTES, SpooledPage, clean_and_truncate, clean_main_content, iter_html_text, remove_unicode,
+    strip_html_tags, truncate,
+)
 
 # Patch stdout/stderr encoding to UTF-8 to avoid cp932 issues
 if hasattr(sys.stdout, "reconfigure"):
     sys.stdout.reconfigure(encoding="utf-8")
 if hasattr(sys.stderr, "reconfigure"):
     sys.stderr.reconfigure(encoding="utf-8")
-# Create an MCP server
-mcp = FastMCP("julien_mcp_features")
+
+def _env_int(name: str, default: int) -> int:
+    """Read an integer setting from the environment, falling back to a default."""
+    value = os.environ.get(name)
+    return int(value) if value else default
+
+def _env_float(name: str, default: float) -> float:
+    """Read a float setting from the environment, falling back to a default."""
+    value = os.environ.get(name)
+    return float(value) if value else default
+
 #NOTES_FILES = "julien_generated_notes.txt"
 NOTES_FILE = os.path.join(os.path.dirname(__file__),"julien_generated_notes.txt")
-# Constants
-MAX_RESULT_BYTES = 300_000 #instead oi 1_000_000 
+# read_note_in_a_file returns NOTES_READ_LIMIT notes unless asked for more, never more than NOTES_READ_MAX_LIMIT
+NOTES_READ_LIMIT = _env_int("MCP_NOTES_READ_LIMIT", 200)
+NOTES_READ_MAX_LIMIT = _env_int("MCP_NOTES_READ_MAX_LIMIT", 1000)
+NOTES_SEARCH_MAX_LIMIT = _env_int("MCP_NOTES_SEARCH_MAX_LIMIT", 50)
+
+# Outbound HTTP client settings (override with MCP_HTTP_* environment variables)
+HTTP_MAX_CONNECTIONS = _env_int("MCP_HTTP_MAX_CONNECTIONS", 100)
+HTTP_MAX_KEEPALIVE_CONNECTIONS = _env_int("MCP_HTTP_MAX_KEEPALIVE_CONNECTIONS", 20)
+HTTP_KEEPALIVE_EXPIRY = _env_float("MCP_HTTP_KEEPALIVE_EXPIRY", 60.0)
+HTTP_CONNECT_TIMEOUT = _env_float("MCP_HTTP_CONNECT_TIMEOUT", 5.0)
+HTTP_TIMEOUT = _env_float("MCP_HTTP_TIMEOUT", 15.0)
+HTTP_HEADERS = {
+    "User-Agent": "(MCP Weather Tool, contact@example.com)",
+    "Accept": "application/geo+json, application/json;q=0.9, */*;q=0.8",
+}
+
+# Requests per second and burst size allowed against each upstream host
+UPSTREAM_RATE_LIMITS = {
+    "geocoding.geo.census.gov": (_env_float("MCP_CENSUS_RATE_LIMIT", 10.0), 10),
+    "api.weather.gov": (_env_float("MCP_NWS_RATE_LIMIT", 10.0), 10),
+    "geocoding-api.open-meteo.com": (_env_float("MCP_OPEN_METEO_RATE_LIMIT", 10.0), 10),
+    "api.open-meteo.com": (_env_float("MCP_OPEN_METEO_RATE_LIMIT", 10.0), 10),
+}
+# Concurrent Open-Meteo forecast requests arriving within this window share one upstream call
+OPEN_METEO_BATCH_WINDOW = _env_float("MCP_OPEN_METEO_BATCH_WINDOW", 0.01)
+OPEN_METEO_BATCH_MAX = _env_int("MCP_OPEN_METEO_BATCH_MAX", 50)
+WEATHER_BATCH_CONCURRENCY = _env_int("MCP_WEATHER_BATCH_CONCURRENCY", 8)
+WEATHER_BATCH_MAX_CITIES = _env_int("MCP_WEATHER_BATCH_MAX_CITIES", 50)
+
+# Warm pool of headless browsers for the crawl tools (0 disables the pool)
+CRAWLER_POOL_SIZE = _env_int("MCP_CRAWLER_POOL_SIZE", 2)
+CRAWLER_MAX_PAGES_PER_BROWSER = _env_int("MCP_CRAWLER_MAX_PAGES_PER_BROWSER", 50)
+CRAWLER_POOL_MAX_WAITERS = _env_int("MCP_CRAWLER_POOL_MAX_WAITERS", 32)
+CRAWLER_POOL_ACQUIRE_TIMEOUT = _env_float("MCP_CRAWLER_POOL_ACQUIRE_TIMEOUT", 60.0)
+# Cleaned crawl results: reused for CRAWL_CACHE_TTL, then revalidated with a conditional request
+CRAWL_CACHE_TTL = _env_float("MCP_CRAWL_CACHE_TTL", 3600.0)
+CRAWL_CACHE_MAX_BYTES = _env_int("MCP_CRAWL_CACHE_MAX_BYTES", 200_000_000)
+CRAWL_REVALIDATE_TIMEOUT = _env_float("MCP_CRAWL_REVALIDATE_TIMEOUT", 5.0)
+# Hard cap on the HTML characters of one page (plain GETs stop reading there, rendered pages are cut);
+# plain GET bodies over CRAWL_SPOOL_BYTES are kept in a temporary file in CRAWL_SPOOL_DIR (default:
+# the system temp directory; point it at a disk when that is a RAM-backed tmpfs) while they are cleaned
+CRAWL_MAX_PAGE_BYTES = _env_int("MCP_CRAWL_MAX_PAGE_BYTES", 5_000_000)
+CRAWL_SPOOL_BYTES = _env_int("MCP_CRAWL_SPOOL_BYTES", 1_000_000)
+CRAWL_SPOOL_DIR = os.environ.get("MCP_CRAWL_SPOOL_DIR") or None
+# HTTP-first crawling: pages with less than CRAWL_HTTP_MIN_TEXT_BYTES of visible text
+# are treated as JavaScript-rendered
+CRAWL_HTTP_TIMEOUT = _env_float("MCP_CRAWL_HTTP_TIMEOUT", 10.0)
+# Plain GETs of web pages present a desktop browser's User-Agent rather than the weather
+# client's, since many sites turn other agents away
+CRAWL_USER_AGENT = os.environ.get("MCP_CRAWL_USER_AGENT") or (
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0.0.0 Safari/537.36"
+)
+CRAWL_HTTP_MIN_TEXT_BYTES = _env_int("MCP_CRAWL_HTTP_MIN_TEXT_BYTES", 200)
+CRAWL_MODES = ("auto", "http", "browser")
+CRAWL_EXTRACT_MODES = ("all", "main")
+# While a page is cleaned, its text is sent to clients (as log messages) at least
+# CRAWL_PARTIAL_BYTES at a time
+CRAWL_PARTIAL_BYTES = _env_int("MCP_CRAWL_PARTIAL_BYTES", 32_000)
+# Cleaning jobs bigger than CLEAN_OFFLOAD_BYTES of HTML run off the event loop, in a background
+# thread or, with CLEAN_WORKERS > 0, a pool of that many processes. Workers import only
+# html_cleaning, but spawn also re-runs the launching script (the mcp CLI, some 50 MB), so
+# each costs tens of MB resident: worth it only when many large pages are cleaned at once
+# (and text cleaned in a worker process only reaches the client with the tool result)
+CLEAN_OFFLOAD_BYTES = _env_int("MCP_CLEAN_OFFLOAD_BYTES", 500_000)
+CLEAN_WORKERS = _env_int("MCP_CLEAN_WORKERS", 0)
+# crawl_web_truncated keeps whole cleaned documents (up to CRAWL_DOCUMENT_MAX_BYTES each)
+# in memory and serves them CRAWL_PAGE_BYTES at a time through crawl://{doc_id}/{page}
+CRAWL_PAGE_BYTES = _env_int("MCP_CRAWL_PAGE_BYTES", 100_000)
+CRAWL_DOCUMENT_MAX_BYTES = _env_int("MCP_CRAWL_DOCUMENT_MAX_BYTES", 10_000_000)
+CRAWL_DOCUMENTS_MAX_BYTES = _env_int("MCP_CRAWL_DOCUMENTS_MAX_BYTES", 50_000_000)
+# crawl_many: pages crawled at once, and seconds between requests to the same domain.
+# One pooled browser crawls at most CRAWL_MANY_LEASE_PAGES links before it goes back to
+# the pool, so a long batch makes single-page crawls wait for one slice, not the whole batch
+CRAWL_MANY_MAX_LINKS = _env_int("MCP_CRAWL_MANY_MAX_LINKS", 50)
+CRAWL_MANY_CONCURRENCY = _env_int("MCP_CRAWL_MANY_CONCURRENCY", 5)
+CRAWL_MANY_LEASE_PAGES = _env_int("MCP_CRAWL_MANY_LEASE_PAGES", 10)
+CRAWL_DOMAIN_DELAY = _env_float("MCP_CRAWL_DOMAIN_DELAY", 1.0)
+# crawl_site: hard caps on the caller's max_pages/max_depth, and parallel workers
+CRAWL_SITE_MAX_PAGES = _env_int("MCP_CRAWL_SITE_MAX_PAGES", 100)
+CRAWL_SITE_MAX_DEPTH = _env_int("MCP_CRAWL_SITE_MAX_DEPTH", 5)
+CRAWL_SITE_CONCURRENCY = _env_int("MCP_CRAWL_SITE_CONCURRENCY", 2)
+# Pages fingerprinted across calls to crawl_many, crawl_site and the summarize tool, for
+# near-duplicate detection (oldest dropped first; under 1 KB each)
+CRAWL_FINGERPRINTS_SIZE = _env_int("MCP_CRAWL_FINGERPRINTS_SIZE", 20_000)
+# crawl_web_summarize_and_truncate: pages are cleaned up to SUMMARY_MAX_INPUT_BYTES, split
+# into chunks of at most SUMMARY_CHUNK_BYTES, summarized SUMMARY_CONCURRENCY at a time,
+# and the chunk summaries merged in one final request
+SUMMARY_MAX_INPUT_BYTES = _env_int("MCP_SUMMARY_MAX_INPUT_BYTES", 100_000)
+SUMMARY_CHUNK_BYTES = _env_int("MCP_SUMMARY_CHUNK_BYTES", 4000)
+SUMMARY_CONCURRENCY = _env_int("MCP_SUMMARY_CONCURRENCY", 4)
+SUMMARY_MAX_TOKENS = _env_int("MCP_SUMMARY_MAX_TOKENS", 1000)
+SUMMARY_CACHE_SIZE = _env_int("MCP_SUMMARY_CACHE_SIZE", 4096)
+SUMMARY_CACHE_TTL = _env_float("MCP_SUMMARY_CACHE_TTL", 30 * 24 * 3600.0)
+# Re-summarizing a known URL updates its previous summary in place when at most this
+# fraction of its chunks changed; bigger changes are summarized from scratch
+SUMMARY_INCREMENTAL_MAX_CHANGE = _env_float("MCP_SUMMARY_INCREMENTAL_MAX_CHANGE", 0.5)
+# A page summarized for the first time borrows the summary of a page on the same host whose
+# SimHash is at most this many bits away (shared navigation alone can come within 7 bits)
+SUMMARY_REUSE_MAX_DISTANCE = _env_int("MCP_SUMMARY_REUSE_MAX_DISTANCE", 3)
+# crawl_screenshot: thumbnails are at most SCREENSHOT_MAX_WIDTH wide (never narrower than
+# SCREENSHOT_MIN_WIDTH), encoded to fit SCREENSHOT_MAX_BYTES, and at most SCREENSHOT_MAX_ASPECT
+# times taller than wide (full-page captures of long pages keep their top part)
+SCREENSHOT_MAX_BYTES = _env_int("MCP_SCREENSHOT_MAX_BYTES", 100_000)
+SCREENSHOT_MAX_WIDTH = _env_int("MCP_SCREENSHOT_MAX_WIDTH", 1600)
+SCREENSHOT_MIN_WIDTH = _env_int("MCP_SCREENSHOT_MIN_WIDTH", 160)
+SCREENSHOT_MAX_ASPECT = _env_float("MCP_SCREENSHOT_MAX_ASPECT", 3.0)
+SCREENSHOT_CACHE_SIZE = _env_int("MCP_SCREENSHOT_CACHE_SIZE", 64)
+SCREENSHOT_CACHE_TTL = _env_float("MCP_SCREENSHOT_CACHE_TTL", 600.0)
+SCREENSHOT_FORMATS = ("webp", "jpeg")
+
+# On-disk cache shared by the weather and crawl tools
+CACHE_DB_FILE = os.path.join(os.path.dirname(__file__), "julien_mcp_cache.sqlite3")
+GEOCODE_CACHE_SIZE = _env_int("MCP_GEOCODE_CACHE_SIZE", 2048)
+GEOCODE_NEGATIVE_TTL = _env_float("MCP_GEOCODE_NEGATIVE_TTL", 24 * 3600.0)
+NWS_POINTS_CACHE_SIZE = _env_int("MCP_NWS_POINTS_CACHE_SIZE", 2048)
+NWS_POINTS_TTL = _env_float("MCP_NWS_POINTS_TTL", 7 * 24 * 3600.0)
+FORECAST_CACHE_SIZE = _env_int("MCP_FORECAST_CACHE_SIZE", 512)
+# How long past expiry a forecast may be served while it is refreshed in the background,
+# when the upstream does not send its own stale-while-revalidate directive
+FORECAST_STALE_WHILE_REVALIDATE = _env_float("MCP_FORECAST_STALE_WHILE_REVALIDATE", 900.0)
+
+
+
+#################################################
+################# HTTP CLIENT ###################
+#################################################
+
+
+# Shared pooled client, opened by the server lifespan
+_http_client: httpx.AsyncClient | None = None
+_lifespan_users = 0
+
+def _new_http_client() -> httpx.AsyncClient:
+    """Create the long-lived pooled client shared by all outbound tools."""
+    return httpx.AsyncClient(
+        headers=HTTP_HEADERS,
+        # HTTP/2 needs the optional h2 package (httpx[http2])
+        http2=importlib.util.find_spec("h2") is not None,
+        limits=httpx.Limits(
+            max_connections=HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+        ),
+        timeout=httpx.Timeout(HTTP_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+        follow_redirects=True,
+    )
+
+@asynccontextmanager
+async def _outbound_client() -> AsyncIterator[httpx.AsyncClient]:
+    """Yield the shared client, or a throwaway one when called outside the server lifespan."""
+    if _http_client is not None:
+        yield _http_client
+        return
+    async with httpx.AsyncClient(headers=HTTP_HEADERS, timeout=HTTP_TIMEOUT) as client:
+        yield client
+
+class AsyncRateLimiter:
+    """Token bucket (virtual scheduling form) pacing calls to one upstream host."""
+
+    def __init__(self, rate: float, burst: int = 1):
+        self._interval = 1.0 / rate
+        self._burst_window = (max(burst, 1) - 1) * self._interval
+        self._next_slot = 0.0
+
+    async def acquire(self) -> None:
+        # No await between reading and reserving the slot, so no lock is needed
+        now = time.monotonic()
+        slot = max(self._next_slot, now)
+        self._next_slot = slot + self._interval
+        delay = slot - now - self._burst_window
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+_rate_limiters = {host: AsyncRateLimiter(rate, burst) for host, (rate, burst) in UPSTREAM_RATE_LIMITS.items()}
+
+async def _upstream_get(client: httpx.AsyncClient, url: str, **kwargs) -> httpx.Response:
+    """GET through the per-host rate limiter."""
+    limiter = _rate_limiters.get(urlsplit(url).hostname or "")
+    if limiter is not None:
+        await limiter.acquire()
+    return await client.get(url, **kwargs)
+
+@asynccontextmanager
+async def server_lifespan(server: FastMCP) -> AsyncIterator[dict]:
+    """Open shared resources when the server starts and close them on shutdown."""
+    global _http_client, _crawler_pool, _clean_executor, _lifespan_users
+    # Transports may enter the lifespan once per session, so refcount the shared resources
+    _lifespan_users += 1
+    if _lifespan_users == 1:
+        _http_client = _new_http_client()
+        _crawler_pool = await _start_crawler_pool()
+        _clean_executor = _new_clean_executor()
+    try:
+        yield {"http_client": _http_client, "crawler_pool": _crawler_pool, "clean_executor": _clean_executor}
+    finally:
+        _lifespan_users -= 1
+        if _lifespan_users == 0:
+            client, _http_client = _http_client, None
+            pool, _crawler_pool = _crawler_pool, None
+            executor, _clean_executor = _clean_executor, None
+            await client.aclose()
+            if pool is not None:
+                await pool.close()
+            if executor is not None:
+                executor.shutdown(wait=False, cancel_futures=True)
+
+# Create an MCP server
+mcp = FastMCP("julien_mcp_features", lifespan=server_lifespan)
+
+
+
+#################################################
+#################### CACHES #####################
+#################################################
+
+
+# Sentinel for cache misses, since None is a valid (negative) cached value
+_MISSING = object()
+
+class LRUCache:
+    """In-memory LRU map with optional per-entry expiry times."""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._data: OrderedDict[str, tuple[Any, float | None]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: str, default: Any = _MISSING) -> Any:
+        item = self._data.get(key)
+        if item is None:
+            return default
+        value, expires = item
+        if expires is not None and expires <= time.time():
+            del self._data[key]
+            return default
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: Any, expires: float | None = None) -> None:
+        self._data[key] = (value, expires)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key: str) -> None:
+        self._data.pop(key, None)
+
+    def clear(self) -> None:
+        self._data.clear()
+
+
+_CACHE_SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS cache ("
+    "namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT, expires REAL, "
+    "PRIMARY KEY (namespace, key))",
+    "CREATE TABLE IF NOT EXISTS crawl_cache ("
+    "url TEXT PRIMARY KEY, text TEXT NOT NULL, max_bytes INTEGER NOT NULL, complete INTEGER NOT NULL, "
+    "etag TEXT, last_modified TEXT, fetched_at REAL NOT NULL, accessed_at REAL NOT NULL, size INTEGER NOT NULL, "
+    "rendered INTEGER NOT NULL DEFAULT 0)",
+    "CREATE INDEX IF NOT EXISTS crawl_cache_accessed ON crawl_cache (accessed_at)",
+)
+# Columns added since a table was first created, for cache files written by older versions
+_CACHE_MIGRATIONS = (
+    "ALTER TABLE crawl_cache ADD COLUMN rendered INTEGER NOT NULL DEFAULT 0",
+)
+_initialized_cache_files: set[str] = set()
+
+def _connect_cache_db() -> sqlite3.Connection:
+    """Open CACHE_DB_FILE, creating the cache tables on first use."""
+    db = sqlite3.connect(CACHE_DB_FILE)
+    if CACHE_DB_FILE not in _initialized_cache_files:
+        for statement in _CACHE_SCHEMA:
+            db.execute(statement)
+        for statement in _CACHE_MIGRATIONS:
+            try:
+                db.execute(statement)
+            except sqlite3.OperationalError:
+                pass  # already applied
+        db.commit()
+        _initialized_cache_files.add(CACHE_DB_FILE)
+    return db
+
+
+class PersistentCache:
+    """LRU front backed by a SQLite table in CACHE_DB_FILE, so entries survive restarts.
+
+    A value of None is a negative entry ("looked up, nothing there") and is
+    kept for negative_ttl seconds; other values are kept for ttl seconds
+    (forever when ttl is None). Values must be JSON serialisable.
+    """
+
+    def __init__(self, namespace: str, maxsize: int, ttl: float | None = None,
+                 negative_ttl: float | None = None):
+        self.namespace = namespace
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.memory = LRUCache(maxsize)
+
+    def get(self, key: str) -> Any:
+        """Return the cached value, None for a negative entry, or _MISSING."""
+        value = self.memory.get(key)
+        if value is not _MISSING:
+            return value
+        try:
+            with closing(_connect_cache_db()) as db:
+                row = db.execute(
+                    "SELECT value, expires FROM cache WHERE namespace = ? AND key = ?",
+                    (self.namespace, key),
+                ).fetchone()
+        except sqlite3.Error:
+            return _MISSING
+        if row is None or (row[1] is not None and row[1] <= time.time()):
+            return _MISSING
+        value = None if row[0] is None else json.loads(row[0])
+        self.memory.set(key, value, row[1])
+        return value
+
+    def set(self, key: str, value: Any) -> None:
+        ttl = self.negative_ttl if value is None else self.ttl
+        expires = None if ttl is None else time.time() + ttl
+        self.memory.set(key, value, expires)
+        try:
+            with closing(_connect_cache_db()) as db:
+                db.execute(
+                    "INSERT OR REPLACE INTO cache (namespace, key, value, expires) VALUES (?, ?, ?, ?)",
+                    (self.namespace, key, None if value is None else json.dumps(value), expires),
+                )
+                db.commit()
+        except sqlite3.Error:
+            pass  # the in-memory entry still helps; a read-only disk must not break the tools
+
+    def clear_memory(self) -> None:
+        self.memory.clear()
+
+
+class HttpResponseCache:
+    """In-memory cache of JSON responses that follows the upstream caching headers.
+
+    Freshness comes from Cache-Control (max-age/s-maxage, no-cache, no-store)
+    or Expires. Stale entries are returned immediately while a background
+    request refreshes them, for the upstream's stale-while-revalidate window
+    or, when it has none, for stale_while_revalidate after a positive
+    lifetime; must-revalidate responses are never served stale. Expired
+    entries are revalidated with
+    If-None-Match/If-Modified-Since so a 304 avoids re-downloading the body.
+    """
+
+    def __init__(self, maxsize: int, stale_while_revalidate: float):
+        self.stale_while_revalidate = stale_while_revalidate
+        self.entries = LRUCache(maxsize)
+        self._refreshing: dict[str, asyncio.Task] = {}
+
+    async def get_json(self, client: httpx.AsyncClient, url: str,
+                       loader: Callable[[httpx.AsyncClient], Awaitable[tuple[Any, Any]]] | None = None) -> Any:
+        """Return the JSON body for url. An optional loader(client) -> (body, headers)
+        replaces the plain GET for unconditional fetches (used for request coalescing)."""
+        entry = self.entries.get(url, None)
+        now = time.time()
+        if entry is not None:
+            if now < entry["fresh_until"]:
+                return entry["body"]
+            if now < entry["stale_until"]:
+                self._refresh_in_background(url)
+                return entry["body"]
+        return await self._fetch(client, url, entry, loader)
+
+    async def _fetch(self, client: httpx.AsyncClient, url: str, entry: dict | None,
+                     loader: Callable[[httpx.AsyncClient], Awaitable[tuple[Any, Any]]] | None = None) -> Any:
+        headers = {}
+        if entry is not None:
+            if entry["etag"]:
+                headers["If-None-Match"] = entry["etag"]
+            if entry["last_modified"]:
+                headers["If-Modified-Since"] = entry["last_modified"]
+        if loader is not None and not headers:
+            body, response_headers = await loader(client)
+            self._store(url, body, response_headers, loader=loader)
+            return body
+        response = await _upstream_get(client, url, **({"headers": headers} if headers else {}))
+        if response.status_code == 304 and entry is not None:
+            self._store(url, entry["body"], response.headers, entry, loader)
+            return entry["body"]
+        response.raise_for_status()
+        body = response.json()
+        self._store(url, body, response.headers, loader=loader)
+        return body
+
+    def _store(self, url: str, body: Any, headers: Any, previous: dict | None = None,
+               loader: Callable[[httpx.AsyncClient], Awaitable[tuple[Any, Any]]] | None = None) -> None:
+        directives = _parse_cache_control(headers.get("cache-control", ""))
+        if "no-store" in directives:
+            self.entries.pop(url)
+            return
+        now = time.time()
+        max_age = directives.get("s-maxage", directives.get("max-age"))
+        if "no-cache" in directives:
+            ttl = 0.0
+        elif max_age is not None:
+            ttl = max_age - _parse_seconds(headers.get("age"))
+        elif headers.get("expires"):
+            ttl = _http_date(headers["expires"]) - (_http_date(headers.get("date")) or now)
+        else:
+            ttl = 0.0
+        if "no-cache" in directives or "must-revalidate" in directives or "proxy-revalidate" in directives:
+            stale = 0.0
+        elif "stale-while-revalidate" in directives:
+            stale = directives["stale-while-revalidate"] or 0.0
+        elif ttl > 0:
+            # Our default window only extends responses the upstream let us cache at all
+            stale = self.stale_while_revalidate
+        else:
+            stale = 0.0
+        etag = headers.get("etag") or (previous or {}).get("etag")
+        last_modified = headers.get("last-modified") or (previous or {}).get("last_modified")
+        fresh_until = now + max(ttl, 0.0)
+        if fresh_until + stale <= now and not (etag or last_modified):
+            self.entries.pop(url)  # nothing reusable: neither fresh nor revalidatable
+            return
+        self.entries.set(url, {
+            "body": body,
+            "etag": etag,
+            "last_modified": last_modified,
+            "fresh_until": fresh_until,
+            "stale_until": fresh_until + stale,
+            "loader": loader,
+        })
+
+    def _refresh_in_background(self, url: str) -> None:
+        if url in self._refreshing:
+            return
+        task = asyncio.create_task(self._refresh(url))
+        self._refreshing[url] = task
+        task.add_done_callback(lambda _: self._refreshing.pop(url, None))
+
+    async def _refresh(self, url: str) -> None:
+        try:
+            async with _outbound_client() as client:
+                entry = self.entries.get(url, None)
+                await self._fetch(client, url, entry, entry and entry["loader"])
+        except Exception:
+            pass  # keep serving the stale copy until stale_until; the next miss will surface errors
+
+    def clear(self) -> None:
+        self.entries.clear()
+
+
+def _parse_cache_control(value: str) -> dict[str, float | None]:
+    """Parse a Cache-Control header into {directive: seconds or None}."""
+    directives: dict[str, float | None] = {}
+    for part in value.split(","):
+        name, _, arg = part.strip().partition("=")
+        if name:
+            directives[name.lower()] = _parse_seconds(arg.strip('" ')) if arg else None
+    return directives
+
+def _parse_seconds(value: str | None) -> float:
+    try:
+        return float(value) if value else 0.0
+    except ValueError:
+        return 0.0
+
+def _http_date(value: str | None) -> float:
+    """Convert an HTTP date header to a timestamp (0 when missing or invalid)."""
+    try:
+        return parsedate_to_datetime(value).timestamp() if value else 0.0
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _normalize_location(city: str) -> str:
+    """Normalise a free-form city string into a cache key ("  Seattle ,WA" -> "seattle, wa")."""
+    key = unicodedata.normalize("NFKC", city).casefold()
+    key = re.sub(r"\s*,\s*", ", ", key)
+    return re.sub(r"\s+", " ", key).strip(" ,")
+
+def _normalize_url(url: str) -> str:
+    """Canonical form of a URL for cache keys and dedup.
+
+    Lowercases scheme and host, drops default ports, fragments and empty
+    queries, sorts query parameters and gives bare hosts a "/" path.
+    """
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").lower()
+    port = parts.port
+    if port and (scheme, port) not in (("http", 80), ("https", 443)):
+        host = f"{host}:{port}"
+    if parts.username or parts.password:
+        host = f"{parts.username or ''}{':' + parts.password if parts.password else ''}@{host}"
+    query = "&".join(sorted(param for param in parts.query.split("&") if param))
+    return urlunsplit((scheme, host, parts.path or "/", query, ""))
+
+
+class CrawlCache:
+    """Size-bounded LRU of cleaned crawl results in the crawl_cache table of CACHE_DB_FILE.
+
+    Entries keep the cleaned text together with the byte budget it was
+    cleaned to, so a result cleaned for a larger budget also serves
+    smaller ones. ETag/Last-Modified from the crawl are kept for
+    conditional revalidation once an entry is older than CRAWL_CACHE_TTL,
+    and rendered records whether the text came from a browser rather than
+    a plain GET, so that requests for a rendered page skip the others.
+    """
+
+    @staticmethod
+    def _key(url: str, variant: str) -> str:
+        # Normalised URLs have no fragment, so one can tag other cleanings of the same page
+        return _normalize_url(url) + (f"#{variant}" if variant else "")
+
+    def get(self, url: str, max_bytes: int, variant: str = "", rendered: bool = False) -> dict | None:
+        """Return the entry for url if it holds enough text for max_bytes (and was rendered, if asked)."""
+        key = self._key(url, variant)
+        try:
+            with closing(_connect_cache_db()) as db:
+                row = db.execute(
+                    "SELECT text, max_bytes, complete, etag, last_modified, fetched_at, rendered "
+                    "FROM crawl_cache WHERE url = ?",
+                    (key,),
+                ).fetchone()
+                if row is None or not (row[2] or row[1] >= max_bytes) or (rendered and not row[6]):
+                    return None
+                db.execute("UPDATE crawl_cache SET accessed_at = ? WHERE url = ?", (time.time(), key))
+                db.commit()
+        except sqlite3.Error:
+            return None
+        return {"text": row[0], "etag": row[3], "last_modified": row[4], "fetched_at": row[5]}
+
+    def put(self, url: str, text: str, max_bytes: int, etag: str | None = None, last_modified: str | None = None,
+            variant: str = "", rendered: bool = True) -> None:
+        now = time.time()
+        # Cleaned text has no newlines, so the truncation marker is unambiguous
+        complete = not text.endswith("\n...[truncated]")
+        try:
+            with closing(_connect_cache_db()) as db:
+                db.execute(
+                    "INSERT OR REPLACE INTO crawl_cache "
+                    "(url, text, max_bytes, complete, etag, last_modified, fetched_at, accessed_at, size, rendered) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (self._key(url, variant), text, max_bytes, complete, etag, last_modified, now, now, len(text),
+                     rendered),
+                )
+                self._evict(db)
+                db.commit()
+        except sqlite3.Error:
+            pass  # caching is best effort
+
+    def touch(self, url: str, variant: str = "") -> None:
+        """Mark an entry as fresh again after a 304 Not Modified."""
+        try:
+            with closing(_connect_cache_db()) as db:
+                db.execute("UPDATE crawl_cache SET fetched_at = ? WHERE url = ?", (time.time(), self._key(url, variant)))
+                db.commit()
+        except sqlite3.Error:
+            pass
+
+    @staticmethod
+    def _evict(db: sqlite3.Connection) -> None:
+        total = db.execute("SELECT COALESCE(SUM(size), 0) FROM crawl_cache").fetchone()[0]
+        if total <= CRAWL_CACHE_MAX_BYTES:
+            return
+        for url, size in db.execute("SELECT url, size FROM crawl_cache ORDER BY accessed_at").fetchall():
+            db.execute("DELETE FROM crawl_cache WHERE url = ?", (url,))
+            total -= size
+            if total <= CRAWL_CACHE_MAX_BYTES:
+                break
+
+class CrawlDocumentStore:
+    """In-memory LRU of cleaned documents, split into pages of at most page_bytes UTF-8 bytes.
+
+    Documents are keyed by a hash of their text, so crawling an unchanged
+    page again reuses its ID. The store evicts least recently used
+    documents once it holds more than max_bytes.
+    """
+
+    def __init__(self, page_bytes: int, max_bytes: int):
+        self.page_bytes = page_bytes
+        self.max_bytes = max_bytes
+        self._documents: OrderedDict[str, list[str]] = OrderedDict()
+        self._sizes: dict[str, int] = {}
+        self._total = 0
+
+    def __len__(self) -> int:
+        return len(self._documents)
+
+    def put(self, text: str) -> tuple[str, int]:
+        """Store text and return (document ID, page count)."""
+        if text.isascii():
+            # Cleaned crawl text always is: page by slicing and hash page by page,
+            # rather than through a second full-size encoded copy
+            pages = [text[i:i + self.page_bytes] for i in range(0, len(text), self.page_bytes)] or [""]
+            digest = hashlib.blake2b(digest_size=8)
+            for page in pages:
+                digest.update(page.encode("ascii"))
+            doc_id, size = digest.hexdigest(), len(text)
+        else:
+            encoded = text.encode("utf-8")
+            doc_id, size = hashlib.blake2b(encoded, digest_size=8).hexdigest(), len(encoded)
+            pages = None if doc_id in self._documents else self._split(encoded, self.page_bytes)
+            del encoded
+        if doc_id in self._documents:
+            self._documents.move_to_end(doc_id)
+            return doc_id, len(self._documents[doc_id])
+        self._documents[doc_id] = pages
+        self._sizes[doc_id] = size
+        self._total += size
+        while self._total > self.max_bytes and len(self._documents) > 1:
+            oldest, _ = self._documents.popitem(last=False)
+            self._total -= self._sizes.pop(oldest)
+        return doc_id, len(pages)
+
+    def page(self, doc_id: str, page: int) -> tuple[str, int] | None:
+        """Return (page text, page count) for a 1-based page number, or None if unknown."""
+        pages = self._documents.get(doc_id)
+        if pages is None or not 1 <= page <= len(pages):
+            return None
+        self._documents.move_to_end(doc_id)
+        return pages[page - 1], len(pages)
+
+    def clear(self) -> None:
+        self._documents.clear()
+        self._sizes.clear()
+        self._total = 0
+
+    @staticmethod
+    def _split(encoded: bytes, page_bytes: int) -> list[str]:
+        pages = []
+        start = 0
+        while start < len(encoded):
+            end = min(start + page_bytes, len(encoded))
+            # Back off to the start of a UTF-8 character (continuation bytes are 0b10xxxxxx)
+            while end < len(encoded) and end > start + 1 and encoded[end] & 0xC0 == 0x80:
+                end -= 1
+            pages.append(encoded[start:end].decode("utf-8"))
+            start = end
+        return pages or [""]
+
+# City -> coordinates, shared by both weather tools (keys are prefixed per geocoder)
+_geocode_cache = PersistentCache("geocode", GEOCODE_CACHE_SIZE, negative_ttl=GEOCODE_NEGATIVE_TTL)
+# NWS grid cell -> forecast office metadata; the mapping changes only on NWS grid updates
+_nws_points_cache = PersistentCache("nws_points", NWS_POINTS_CACHE_SIZE, ttl=NWS_POINTS_TTL)
+# Forecast payloads from api.weather.gov and api.open-meteo.com, keyed by URL
+_forecast_cache = HttpResponseCache(FORECAST_CACHE_SIZE, FORECAST_STALE_WHILE_REVALIDATE)
+# Cleaned page text for the crawl tools, keyed by normalised URL
+_crawl_cache = CrawlCache()
+# Summaries of page chunks, keyed by a hash of the chunk text
+_summary_cache = PersistentCache("summary", SUMMARY_CACHE_SIZE, ttl=SUMMARY_CACHE_TTL)
+# Last summary per normalised URL, with the hash and summary of each chunk it was built from
+_page_summaries = PersistentCache("page_summary", SUMMARY_CACHE_SIZE, ttl=SUMMARY_CACHE_TTL)
+# Encoded screenshot thumbnails, keyed by normalised URL, width and format
+_screenshot_cache = LRUCache(SCREENSHOT_CACHE_SIZE)
+# Full cleaned documents behind the crawl://{doc_id}/{page} resource
+_crawl_documents = CrawlDocumentStore(CRAWL_PAGE_BYTES, CRAWL_DOCUMENTS_MAX_BYTES)
 
 
 # Add an addition tool
@@ -57,46 +744,88 @@ def calculate_bmi(weight_kg: float, height_m: float) -> float:
 #################################################
 
 
+async def _geocode_us(client: httpx.AsyncClient, city: str) -> dict | None:
+    """Resolve 'City, ST' to {"lat", "lon"} with the Census geocoder, or None if unknown."""
+    key = f"us:{_normalize_location(city)}"
+    cached = _geocode_cache.get(key)
+    if cached is not _MISSING:
+        return cached
+    geocoding_url = f"https://geocoding.geo.census.gov/geocoder/locations/onelineaddress?address={city}&benchmark=2020&format=json"
+    geocode_response = await _upstream_get(client, geocoding_url)
+    geocode_response.raise_for_status()
+    geocode_data = geocode_response.json()
+    try:
+        match = geocode_data["result"]["addressMatches"][0]
+        coordinates = {"lat": match["coordinates"]["y"], "lon": match["coordinates"]["x"]}
+    except (KeyError, IndexError):
+        coordinates = None
+    _geocode_cache.set(key, coordinates)
+    return coordinates
+
+async def _nws_points(client: httpx.AsyncClient, lat: float, lon: float) -> dict:
+    """Look up the NWS forecast office and grid cell for a coordinate."""
+    # api.weather.gov itself only accepts 4 decimal places, so this is the natural cell key
+    key = f"{round(float(lat), 4):.4f},{round(float(lon), 4):.4f}"
+    cached = _nws_points_cache.get(key)
+    if cached is not _MISSING:
+        return cached
+    points_response = await _upstream_get(client, f"https://api.weather.gov/points/{key}")
+    points_response.raise_for_status()
+    properties = points_response.json()["properties"]
+    points = {
+        "forecast": properties["forecast"],
+        "gridId": properties.get("gridId"),
+        "gridX": properties.get("gridX"),
+        "gridY": properties.get("gridY"),
+    }
+    _nws_points_cache.set(key, points)
+    return points
+
+async def _geocode_international(client: httpx.AsyncClient, city: str) -> dict | None:
+    """Resolve a city name to its first Open-Meteo geocoding result, or None if unknown."""
+    key = f"intl:{_normalize_location(city)}"
+    cached = _geocode_cache.get(key)
+    if cached is not _MISSING:
+        return cached
+    geocode_url = f"https://geocoding-api.open-meteo.com/v1/search?name={city}&count=1"
+    geocode_response = await _upstream_get(client, geocode_url)
+    geocode_response.raise_for_status()
+    geocode_data = geocode_response.json()
+    results = geocode_data.get("results")
+    location = None
+    if results:
+        result = results[0]
+        location = {
+            "name": result["name"],
+            "country": result.get("country", ""),
+            "latitude": result["latitude"],
+            "longitude": result["longitude"],
+        }
+    _geocode_cache.set(key, location)
+    return location
+
+
 # Add a way to find weather information
 @mcp.tool()
 async def fetch_US_weather(city: str) -> str:
     """Fetch current weather for a US city using the National Weather Service API"""
-    headers = {
-        "User-Agent": "(MCP Weather Tool, contact@example.com)",
-        "Accept": "application/geo+json"
-    }
-    
     try:
-        async with httpx.AsyncClient(headers=headers) as client:
-            # First get the coordinates for the location
-            points_url = f"https://api.weather.gov/points/{city}"
+        async with _outbound_client() as client:
             if ',' not in city:
                 return "Error: Please provide city and state in format 'City, ST' (e.g., 'Seattle, WA')"
                 
-            # Get geocoding data for the city
-            geocoding_url = f"https://geocoding.geo.census.gov/geocoder/locations/onelineaddress?address={city}&benchmark=2020&format=json"
-            geocode_response = await client.get(geocoding_url)
-            geocode_response.raise_for_status()
-            geocode_data = geocode_response.json()
-            
-            # Extract coordinates from geocoding response
-            try:
-                match = geocode_data["result"]["addressMatches"][0]
-                lat = match["coordinates"]["y"]
-                lon = match["coordinates"]["x"]
-            except (KeyError, IndexError):
+            # Get geocoding data for the city (cached, including misses)
+            coordinates = await _geocode_us(client, city)
+            if coordinates is None:
                 return f"Error: Could not find coordinates for '{city}'"
+            lat, lon = coordinates["lat"], coordinates["lon"]
             
-            # Get the forecast office URL for these coordinates
-            points_response = await client.get(f"https://api.weather.gov/points/{lat},{lon}")
-            points_response.raise_for_status()
-            points_data = points_response.json()
+            # Get the forecast office URL for these coordinates (cached per grid cell)
+            points = await _nws_points(client, lat, lon)
             
-            # Get the forecast
-            forecast_url = points_data["properties"]["forecast"]
-            forecast_response = await client.get(forecast_url)
-            forecast_response.raise_for_status()
-            forecast_data = forecast_response.json()
+            # Get the forecast (honours the upstream Cache-Control/Expires headers)
+            forecast_url = points["forecast"]
+            forecast_data = await _forecast_cache.get_json(client, forecast_url)
             
             # Get the current period's forecast
             current_period = forecast_data["properties"]["periods"][0]
@@ -125,33 +854,22 @@ async def fetch_US_weather(city: str) -> str:
 async def fetch_international_weather(city: str) -> str:
     """Fetch current weather for any city worldwide using Open-Meteo API"""
     try:
-        async with httpx.AsyncClient() as client:
-            # First get the coordinates using geocoding API
-            geocode_url = f"https://geocoding-api.open-meteo.com/v1/search?name={city}&count=1"
-            geocode_response = await client.get(geocode_url)
-            geocode_response.raise_for_status()
-            geocode_data = geocode_response.json()
-            
-            if not geocode_data.get("results"):
+        async with _outbound_client() as client:
+            # First get the coordinates using geocoding API (cached, including misses)
+            location = await _geocode_international(client, city)
+            if location is None:
                 return f"Error: Could not find location '{city}'"
             
-            location = geocode_data["results"][0]
             lat = location["latitude"]
             lon = location["longitude"]
             
-            # Get current weather data
-            weather_url = (
-                f"https://api.open-meteo.com/v1/forecast"
-                f"?latitude={lat}&longitude={lon}"
-                f"&current=temperature_2m,relative_humidity_2m,wind_speed_10m,wind_direction_10m"
-                f"&wind_speed_unit=mph"
-                f"&temperature_unit=fahrenheit"
+            # Get current weather data (coalesced with concurrent requests for other cities)
+            weather_url = _open_meteo_url([lat], [lon])
+            weather_data = await _forecast_cache.get_json(
+                client, weather_url,
+                loader=lambda c: _open_meteo_batcher.fetch(c, lat, lon),
             )
             
-            weather_response = await client.get(weather_url)
-            weather_response.raise_for_status()
-            weather_data = weather_response.json()
-            
             current = weather_data["current"]
             
             # Format the weather information nicely
@@ -171,6 +889,137 @@ async def fetch_international_weather(city: str) -> str:
     except Exception as e:
         return f"Error: {type(e).__name__}: {str(e)}"
 
+OPEN_METEO_CURRENT_FIELDS = "temperature_2m,relative_humidity_2m,wind_speed_10m,wind_direction_10m"
+
+def _open_meteo_url(latitudes: list[float], longitudes: list[float]) -> str:
+    """Build an Open-Meteo current-weather URL for one or more locations."""
+    return (
+        f"https://api.open-meteo.com/v1/forecast"
+        f"?latitude={','.join(str(lat) for lat in latitudes)}"
+        f"&longitude={','.join(str(lon) for lon in longitudes)}"
+        f"&current={OPEN_METEO_CURRENT_FIELDS}"
+        f"&wind_speed_unit=mph"
+        f"&temperature_unit=fahrenheit"
+    )
+
+
+class OpenMeteoBatcher:
+    """Coalesce concurrent Open-Meteo forecast requests into multi-location calls.
+
+    Requests queued within `window` seconds (or until `max_batch` distinct
+    locations are waiting) go out as one request with comma-separated
+    latitude/longitude lists; the response list is split back per caller.
+    """
+
+    def __init__(self, window: float, max_batch: int):
+        self.window = window
+        self.max_batch = max_batch
+        self._pending: dict[tuple[float, float], list[asyncio.Future]] = {}
+        self._client: httpx.AsyncClient | None = None
+        self._timer: asyncio.TimerHandle | None = None
+        self._tasks: set[asyncio.Task] = set()
+
+    async def fetch(self, client: httpx.AsyncClient, lat: float, lon: float) -> tuple[Any, Any]:
+        """Return (current weather payload, response headers) for one location."""
+        if self.window <= 0:
+            bodies, headers = await self._request(client, [(lat, lon)])
+            return bodies[0], headers
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        if not self._pending:
+            # The first caller's client serves the batch; that caller awaits the result, so it stays open
+            self._client = client
+            self._timer = loop.call_later(self.window, self._flush)
+        self._pending.setdefault((lat, lon), []).append(future)
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        return await future
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, {}
+        if batch:
+            task = asyncio.create_task(self._run(self._client, batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, client: httpx.AsyncClient, batch: dict[tuple[float, float], list[asyncio.Future]]) -> None:
+        locations = list(batch)
+        try:
+            bodies, headers = await self._request(client, locations)
+        except Exception as e:
+            for futures in batch.values():
+                for future in futures:
+                    if not future.done():
+                        future.set_exception(e)
+            return
+        for location, body in zip(locations, bodies):
+            for future in batch[location]:
+                if not future.done():
+                    future.set_result((body, headers))
+
+    async def _request(self, client: httpx.AsyncClient, locations: list[tuple[float, float]]) -> tuple[list, Any]:
+        """Fetch one or more locations; returns (payload per location, response headers)."""
+        url = _open_meteo_url([lat for lat, _ in locations], [lon for _, lon in locations])
+        response = await _upstream_get(client, url)
+        response.raise_for_status()
+        body = response.json()
+        # A single location comes back as an object, several as a list in request order
+        bodies = [body] if len(locations) == 1 else body
+        if not isinstance(bodies, list) or len(bodies) != len(locations):
+            raise ValueError("Open-Meteo returned a mismatched multi-location response")
+        return bodies, response.headers
+
+_open_meteo_batcher = OpenMeteoBatcher(OPEN_METEO_BATCH_WINDOW, OPEN_METEO_BATCH_MAX)
+
+# US states, DC and territories accepted by the Census geocoder
+US_STATE_CODES = {
+    "AL", "AK", "AZ", "AR", "CA", "CO", "CT", "DE", "FL", "GA", "HI", "ID", "IL", "IN",
+    "IA", "KS", "KY", "LA", "ME", "MD", "MA", "MI", "MN", "MS", "MO", "MT", "NE", "NV",
+    "NH", "NJ", "NM", "NY", "NC", "ND", "OH", "OK", "OR", "PA", "RI", "SC", "SD", "TN",
+    "TX", "UT", "VT", "VA", "WA", "WV", "WI", "WY", "DC", "PR", "GU", "VI", "AS", "MP",
+}
+
+def _is_us_city(city: str) -> bool:
+    """True for 'City, ST' strings whose suffix is a US state code."""
+    _, comma, state = city.rpartition(",")
+    return bool(comma) and state.strip().upper() in US_STATE_CODES
+
+# Add a way to fetch weather for many cities in one call
+@mcp.tool()
+async def fetch_weather_batch(cities: list[str]) -> str:
+    """Fetch current weather for several cities at once. US cities use 'City, ST'; others use Open-Meteo."""
+    if not cities:
+        return "Error: Please provide at least one city"
+    if len(cities) > WEATHER_BATCH_MAX_CITIES:
+        return f"Error: At most {WEATHER_BATCH_MAX_CITIES} cities can be fetched per call"
+
+    semaphore = asyncio.Semaphore(WEATHER_BATCH_CONCURRENCY)
+
+    async def fetch_one(city: str) -> str:
+        async with semaphore:
+            try:
+                if _is_us_city(city):
+                    return await fetch_US_weather(city)
+                return await fetch_international_weather(city)
+            except Exception as e:
+                return f"Error: {type(e).__name__}: {str(e)}"
+
+    # Repeated cities (ignoring case and spacing) share one lookup
+    tasks: dict[str, asyncio.Task] = {}
+    for city in cities:
+        key = _normalize_location(city)
+        if key not in tasks:
+            tasks[key] = asyncio.create_task(fetch_one(city))
+    await asyncio.gather(*tasks.values())
+
+    return "\n\n".join(
+        f"[{i}] {city}\n{tasks[_normalize_location(city)].result()}"
+        for i, city in enumerate(cities, start=1)
+    )
+
 def _get_wind_direction(degrees: float) -> str:
     """Convert wind direction from degrees to cardinal direction"""
     directions = ["N", "NNE", "NE", "ENE", "E", "ESE", "SE", "SSE",
@@ -185,106 +1034,1035 @@ def _get_wind_direction(degrees: float) -> str:
 #################################################
 
 
-# remove non-unicode characters
-def remove_unicode(text: str) -> str:
-    """Remove non-ASCII characters from a string."""
-    return re.sub(r'[^\x00-\x7F]+', '', text)
-
-# strip HTML tags
-def strip_html_tags(html):
-    # Remove script and style tags with content
-    html = re.sub(r'(?is)<(script|style).*?>.*?(</\1>)', '', html)
-    # Remove all remaining tags
-    html = re.sub(r'<[^>]+>', '', html)
-    # Convert HTML entities (e.g., &nbsp;) to plain text
-    html = re.sub(r'&[a-zA-Z]+;', ' ', html)
-    # Collapse whitespace
-    html = re.sub(r'\s+', ' ', html)
-    return html.strip()
+class CrawlerPoolBusy(RuntimeError):
+    """Raised when no pooled browser frees up in time or the wait queue is full."""
+
+
+class CrawlerPool:
+    """Pre-launched AsyncWebCrawler browsers leased to one request at a time.
+
+    A lease gives the request exclusive use of a browser, so concurrent
+    crawls never share pages or contexts. Browsers are health-checked
+    before each lease and relaunched after max_pages_per_browser crawls
+    or when they die; at most max_waiters requests may queue for a lease.
+    """
+
+    def __init__(self, size: int, max_pages_per_browser: int, max_waiters: int, acquire_timeout: float):
+        self.size = size
+        self.max_pages_per_browser = max_pages_per_browser
+        self.max_waiters = max_waiters
+        self.acquire_timeout = acquire_timeout
+        self._idle: asyncio.Queue[dict] = asyncio.Queue()
+        self._waiters = 0
+        self._replacing: set[asyncio.Task] = set()
+        self._closed = False
+
+    async def start(self) -> None:
+        launched = await asyncio.gather(*(self._launch() for _ in range(self.size)), return_exceptions=True)
+        for crawler in launched:
+            if not isinstance(crawler, BaseException):
+                self._idle.put_nowait({"crawler": crawler, "pages": 0})
+        errors = [e for e in launched if isinstance(e, BaseException)]
+        if errors:
+            raise errors[0]
+
+    async def _launch(self) -> AsyncWebCrawler:
+        crawler = AsyncWebCrawler()
+        await crawler.start()
+        return crawler
+
+    @staticmethod
+    def _healthy(crawler: AsyncWebCrawler) -> bool:
+        if not getattr(crawler, "ready", True):
+            return False
+        browser = getattr(getattr(getattr(crawler, "crawler_strategy", None), "browser_manager", None), "browser", None)
+        return browser is None or browser.is_connected()
+
+    @staticmethod
+    async def _discard(crawler: AsyncWebCrawler) -> None:
+        try:
+            await crawler.close()
+        except Exception:
+            pass  # the browser may already be gone
+
+    @asynccontextmanager
+    async def acquire(self) -> AsyncIterator[AsyncWebCrawler]:
+        """Lease a browser for one crawl."""
+        if self._idle.empty() and self._waiters >= self.max_waiters:
+            raise CrawlerPoolBusy(f"{self._waiters} crawl requests are already waiting for a browser")
+        self._waiters += 1
+        try:
+            slot = await asyncio.wait_for(self._idle.get(), self.acquire_timeout)
+        except TimeoutError:
+            raise CrawlerPoolBusy(f"No browser became free within {self.acquire_timeout:g}s") from None
+        finally:
+            self._waiters -= 1
+
+        try:
+            if not self._healthy(slot["crawler"]):
+                await self._discard(slot["crawler"])
+                slot = {"crawler": await self._launch(), "pages": 0}
+        except BaseException:
+            self._replace_in_background()
+            raise
+
+        try:
+            yield slot["crawler"]
+        finally:
+            slot["pages"] += 1
+            if self._closed:
+                await self._discard(slot["crawler"])
+            elif slot["pages"] >= self.max_pages_per_browser or not self._healthy(slot["crawler"]):
+                await self._discard(slot["crawler"])
+                self._replace_in_background()
+            else:
+                self._idle.put_nowait(slot)
+
+    def _replace_in_background(self) -> None:
+        """Launch a fresh browser for a retired slot without making the caller wait."""
+        async def replace() -> None:
+            try:
+                crawler = await self._launch()
+            except Exception as e:
+                print(f"[crawler pool] relaunch failed: {type(e).__name__}: {e}", file=sys.stderr)
+                await asyncio.sleep(1.0)
+                if not self._closed:
+                    self._replace_in_background()
+                return
+            if self._closed:
+                await self._discard(crawler)
+            else:
+                self._idle.put_nowait({"crawler": crawler, "pages": 0})
+
+        task = asyncio.create_task(replace())
+        self._replacing.add(task)
+        task.add_done_callback(self._replacing.discard)
+
+    async def close(self) -> None:
+        self._closed = True
+        for task in list(self._replacing):
+            task.cancel()
+        while not self._idle.empty():
+            await self._discard(self._idle.get_nowait()["crawler"])
+
+
+# Shared browser pool, opened by the server lifespan
+_crawler_pool: CrawlerPool | None = None
+
+async def _start_crawler_pool() -> CrawlerPool | None:
+    """Launch the browser pool; without one the crawl tools start a browser per call."""
+    if CRAWLER_POOL_SIZE <= 0:
+        return None
+    pool = CrawlerPool(CRAWLER_POOL_SIZE, CRAWLER_MAX_PAGES_PER_BROWSER,
+                       CRAWLER_POOL_MAX_WAITERS, CRAWLER_POOL_ACQUIRE_TIMEOUT)
+    try:
+        await pool.start()
+    except Exception as e:
+        # stdout carries the MCP protocol, so diagnostics go to stderr
+        print(f"[crawler pool] disabled, browsers failed to start: {type(e).__name__}: {e}", file=sys.stderr)
+        await pool.close()
+        return None
+    return pool
+
+@asynccontextmanager
+async def _crawler_session() -> AsyncIterator[AsyncWebCrawler]:
+    """Yield a pooled browser, or launch a throwaway one outside the server lifespan."""
+    if _crawler_pool is not None:
+        async with _crawler_pool.acquire() as crawler:
+            yield crawler
+        return
+    async with AsyncWebCrawler() as crawler:
+        yield crawler
+
+# Worker processes for large cleaning jobs, created by the server lifespan when CLEAN_WORKERS > 0
+_clean_executor: concurrent.futures.Executor | None = None
+
+def _new_clean_executor() -> concurrent.futures.Executor | None:
+    if CLEAN_WORKERS <= 0:
+        return None
+    # spawn: forking a process that runs browser and event-loop threads is unsafe
+    return concurrent.futures.ProcessPoolExecutor(CLEAN_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+
+async def _clean_off_loop(content: "str | SpooledPage", max_bytes: int = MAX_RESULT_BYTES,
+                         extract: str = "all", ctx: Context | None = None) -> str:
+    """clean_and_truncate (or clean_main_content for extract="main") without blocking
+    the event loop on large documents.
+
+    Small jobs run inline. Cleaning stops after max_bytes of text, which rarely
+    takes more than ten times that much HTML, so that bounds the job size;
+    main-content extraction always parses the whole page. Jobs reach worker
+    processes as references to html_cleaning, and a SpooledPage as its path,
+    not as a pickled copy of the page.
+
+    With a ctx, the text is sent as partial results while it is cleaned, so
+    any job that can fill more than one CRAWL_PARTIAL_BYTES batch runs in a
+    thread rather than inline. Worker processes cannot send any.
+    """
+    clean = clean_main_content if extract == "main" else clean_and_truncate
+    size = len(content) if extract == "main" else min(len(content), 10 * max_bytes)
+    stream = ctx is not None and min(len(content), max_bytes) > CRAWL_PARTIAL_BYTES
+    if size < CLEAN_OFFLOAD_BYTES and not stream:
+        return clean(content, max_bytes)
+    loop = asyncio.get_running_loop()
+    if _clean_executor is not None and size >= CLEAN_OFFLOAD_BYTES:
+        try:
+            return await loop.run_in_executor(_clean_executor, clean, content, max_bytes)
+        except concurrent.futures.BrokenExecutor as e:
+            print(f"Cleaning worker pool failed, cleaning in a thread: {e}", file=sys.stderr)
+    # The regex passes hold the GIL in short bursts, so the loop still gets regular turns
+    if not stream:
+        return await asyncio.to_thread(clean, content, max_bytes)
+    # Batches come back to the loop in order, ahead of the job's own result
+    batches: asyncio.Queue[str | None] = asyncio.Queue()
+    job = asyncio.ensure_future(asyncio.to_thread(
+        clean, content, max_bytes, lambda text: loop.call_soon_threadsafe(batches.put_nowait, text),
+        CRAWL_PARTIAL_BYTES,
+    ))
+    job.add_done_callback(lambda _: batches.put_nowait(None))
+    while (text := await batches.get()) is not None:
+        await _send_partial(ctx, text)
+    return await job
+
+async def _cached_crawl_text(link: str, max_bytes: int, extract: str = "all", rendered: bool = False) -> str | None:
+    """Cleaned text for link from the crawl cache, revalidating entries past CRAWL_CACHE_TTL.
+    With rendered, only text that came from a browser is returned."""
+    variant = "" if extract == "all" else extract
+    entry = _crawl_cache.get(link, max_bytes, variant, rendered)
+    if entry is None:
+        return None
+    if time.time() - entry["fetched_at"] >= CRAWL_CACHE_TTL:
+        if not await _not_modified(link, entry["etag"], entry["last_modified"]):
+            return None
+        _crawl_cache.touch(link, variant)
+    return truncate(entry["text"], max_bytes)
+
+async def _not_modified(link: str, etag: str | None, last_modified: str | None) -> bool:
+    """Cheap conditional GET: True when the server answers 304 Not Modified."""
+    headers = {}
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+    if not headers:
+        return False
+    try:
+        async with _outbound_client() as client:
+            # Streamed so a 200 response body is never downloaded
+            async with client.stream("GET", link, headers={**_CRAWL_HEADERS, **headers}, timeout=CRAWL_REVALIDATE_TIMEOUT) as response:
+                return response.status_code == 304
+    except httpx.HTTPError:
+        return False
+
+def _store_crawl_text(link: str, result: Any, text: str, max_bytes: int, extract: str = "all") -> None:
+    """Cache cleaned text along with the validators from the crawl response."""
+    response_headers = getattr(result, "response_headers", None)
+    headers = {str(k).lower(): v for k, v in response_headers.items()} if isinstance(response_headers, dict) else {}
+    _crawl_cache.put(link, text, max_bytes, headers.get("etag"), headers.get("last-modified"),
+                     "" if extract == "all" else extract, rendered=not isinstance(result, HttpCrawlResult))
+
+async def _report_progress(ctx: Context | None, progress: float, total: float, message: str) -> None:
+    """Best-effort progress notification; a client that cannot take one must not fail the crawl."""
+    if ctx is None:
+        return
+    try:
+        await ctx.report_progress(progress, total, message)
+    except Exception:
+        pass
+
+async def _send_partial(ctx: Context | None, text: str) -> None:
+    """Send partial results ahead of the tool result, as log messages from the crawl.partial logger."""
+    if ctx is None or not text:
+        return
+    try:
+        await ctx.log("info", text, logger_name="crawl.partial")
+    except Exception:
+        pass
+
+class HttpCrawlResult:
+    """The parts of a crawl4ai CrawlResult that _clean_crawl_result reads, for plain HTTP fetches.
+
+    Bodies over CRAWL_SPOOL_BYTES are in body (a SpooledPage), and html then
+    holds only their first CRAWL_SPOOL_BYTES, for the rendering heuristics.
+    truncated is set when the body was cut at CRAWL_MAX_PAGE_BYTES.
+    """
+
+    extracted_content = None
+
+    def __init__(self, url: str, status_code: int, html: str, response_headers: dict, content_type: str,
+                 body: SpooledPage | None = None, truncated: bool = False):
+        self.url = url
+        self.status_code = status_code
+        self.success = 200 <= status_code < 300
+        self.error_message = f"HTTP {status_code}"
+        self.html = html
+        self.response_headers = response_headers
+        self.content_type = content_type
+        self.body = body
+        self.truncated = truncated
+
+    def close(self) -> None:
+        if self.body is not None:
+            self.body.close()
+
+_CRAWL_HEADERS = {
+    "User-Agent": CRAWL_USER_AGENT,
+    "Accept": "text/html,application/xhtml+xml;q=0.9,text/plain;q=0.8,*/*;q=0.5",
+}
+_TEXT_CONTENT_TYPES = ("text/html", "application/xhtml+xml", "text/plain")
+# Empty mount points of client-side frameworks (React, Vue, Next.js, Nuxt, Angular)
+_SPA_SHELL_RE = re.compile(
+    r"""<div[^>]*\sid=["']?(?:root|app|__next|__nuxt)\b[^>]*>\s*</div>|<app-root[^>]*>\s*</app-root>""",
+    re.IGNORECASE,
+)
+_NOSCRIPT_JS_RE = re.compile(r"<noscript[^>]*>[^<]{0,200}(?:enable|requires?|turn on)[^<]{0,40}javascript", re.IGNORECASE)
+
+async def _http_fetch(link: str) -> HttpCrawlResult:
+    """GET link on the shared client, reading at most CRAWL_MAX_PAGE_BYTES of the body
+    and spooling bodies over CRAWL_SPOOL_BYTES to a temporary file as they arrive.
+    The caller closes the result."""
+    body: SpooledPage | None = None
+    try:
+        async with _outbound_client() as client:
+            async with client.stream(
+                "GET", link, headers=_CRAWL_HEADERS, timeout=CRAWL_HTTP_TIMEOUT, follow_redirects=True
+            ) as response:
+                content_type = response.headers.get("content-type", "").split(";")[0].strip().lower()
+                chunks: list[str] = []
+                size = 0
+                truncated = False
+                if content_type in _TEXT_CONTENT_TYPES or not content_type:
+                    async for chunk in response.aiter_text():
+                        if size + len(chunk) > CRAWL_MAX_PAGE_BYTES:
+                            # Only a chunk that does not fit proves there was more to the page
+                            chunk = chunk[:CRAWL_MAX_PAGE_BYTES - size]
+                            truncated = True
+                        size += len(chunk)
+                        if body is not None:
+                            body.write(chunk)
+                        else:
+                            chunks.append(chunk)
+                            if size > CRAWL_SPOOL_BYTES:
+                                # Keep the head for _needs_browser, everything else goes to disk
+                                chunks = ["".join(chunks)]
+                                body = SpooledPage(directory=CRAWL_SPOOL_DIR)
+                                body.write(chunks[0])
+                        if truncated:
+                            break
+                if body is not None:
+                    body.finish()
+                    body.truncated = truncated
+                return HttpCrawlResult(str(response.url), response.status_code, "".join(chunks)[:CRAWL_SPOOL_BYTES],
+                                       dict(response.headers), content_type, body, truncated)
+    except BaseException:
+        if body is not None:
+            body.close()
+        raise
+
+def _needs_browser(result: HttpCrawlResult) -> bool:
+    """Heuristic: does this HTTP response look like a page that only renders with JavaScript?"""
+    if not result.success or result.content_type not in _TEXT_CONTENT_TYPES + ("",):
+        return True
+    if _SPA_SHELL_RE.search(result.html):
+        return True
+    # Cleaning stops at the threshold, so this costs little even on large pages
+    text = clean_and_truncate(result.html, CRAWL_HTTP_MIN_TEXT_BYTES * 5)
+    if len(text) < CRAWL_HTTP_MIN_TEXT_BYTES:
+        return True
+    return len(text) < CRAWL_HTTP_MIN_TEXT_BYTES * 5 and _NOSCRIPT_JS_RE.search(result.html) is not None
+
+async def _crawl_and_clean(link: str, max_bytes: int, mode: str = "auto", extract: str = "all",
+                           ctx: Context | None = None, total: float = 2) -> tuple[str, str | None]:
+    """Fetch link (or reuse the crawl cache) and return (cleaned text, error message).
+
+    mode "http" uses a plain GET, "browser" always renders with crawl4ai,
+    and "auto" tries a plain GET first and renders only pages that need it;
+    "browser" is never answered with cached text from a plain GET.
+    extract "main" keeps only the main content of the page.
+    With a ctx, fetching and cleaning are reported as steps 0 and 1 of total.
+    """
+    cached = await _cached_crawl_text(link, max_bytes, extract, rendered=mode == "browser")
+    if cached is not None:
+        await _report_progress(ctx, 2, total, "Using cached page")
+        return cached, None
+    await _report_progress(ctx, 0, total, f"Fetching {link}")
+    if mode != "browser":
+        try:
+            page = await _http_fetch(link)
+        except httpx.HTTPError as e:
+            if mode == "http":
+                return "", f"Crawl failed: {type(e).__name__}: {remove_unicode(str(e))}"
+        else:
+            try:
+                if mode == "http" and page.content_type not in _TEXT_CONTENT_TYPES + ("",):
+                    return "", f"Crawl failed: Unsupported content type {page.content_type}"
+                if mode == "http" or not _needs_browser(page):
+                    await _report_progress(ctx, 1, total, "Cleaning page")
+                    return await _clean_crawl_result(link, page, max_bytes, extract, ctx)
+            finally:
+                page.close()
+            await _report_progress(ctx, 0, total, "Page needs JavaScript, rendering it in a browser")
+    async with _crawler_session() as crawler:
+        result = await crawler.arun(url=link)
+    if not result:
+        return "", "Crawl failed: No result returned"
+    await _report_progress(ctx, 1, total, "Cleaning page")
+    return await _clean_crawl_result(link, result[0], max_bytes, extract, ctx)
+
+async def _clean_crawl_result(link: str, result: Any, max_bytes: int, extract: str = "all",
+                              ctx: Context | None = None) -> tuple[str, str | None]:
+    """Clean one crawl4ai result, cache it, and return (cleaned text, error message).
+    With a ctx, the text is sent as partial results while it is cleaned."""
+    if not result.success:
+        error_msg = getattr(result, 'error_message', 'Unknown error')
+        return "", f"Crawl failed: {remove_unicode(str(error_msg))}"
     
-#truncate text
-def truncate(text: str, max_bytes: int = MAX_RESULT_BYTES) -> str:
-    """Truncate a string to fit within a byte limit."""
-    encoded = text.encode("utf-8")
-    if len(encoded) <= max_bytes:
-        return text
-    return encoded[:max_bytes].decode("utf-8", errors="ignore") + "\n...[truncated]"
+    # Try to get extracted content first, fall back to HTML if not available;
+    # main-content extraction needs the page structure, so it always works on the HTML
+    body = result.body if isinstance(result, HttpCrawlResult) else None
+    content = body or (result.html if extract == "main" else None) or result.extracted_content or result.html
+    if not content:
+        return "", "Crawl succeeded but no content was returned."
+
+    truncated = isinstance(result, HttpCrawlResult) and result.truncated
+    if isinstance(content, str) and len(content) > CRAWL_MAX_PAGE_BYTES:
+        # Rendered pages arrive whole and the caller holds on to them while they are
+        # cleaned, so a copy on disk would not lower peak memory: just cut them
+        content = content[:CRAWL_MAX_PAGE_BYTES]
+        truncated = True
+
+    # Clean up the content: strip HTML, remove non-unicode chars, and truncate,
+    # stopping as soon as the size limit is reached
+    cleaned = await _clean_off_loop(content, max_bytes, extract, ctx)
+    if not cleaned:
+        return "", "Crawl succeeded but content was empty after cleaning."
+    if truncated and not cleaned.endswith("\n...[truncated]"):
+        # The page itself was cut at CRAWL_MAX_PAGE_BYTES; the marker also keeps the
+        # crawl cache from treating the text as complete
+        cleaned += "\n...[truncated]"
+    _store_crawl_text(link, result, cleaned, max_bytes, extract)
+    return cleaned, None
 
 # Add a crawl_web tool that truncates
 @mcp.tool()
-async def crawl_web_truncated(link: str) -> str:
-    """Crawl the web page, clean and truncate its content to fit size limits."""
+async def crawl_web_truncated(link: str, mode: str = "auto", extract: str = "all", ctx: Context = None) -> str:
+    """Crawl the web page and return its cleaned content.
+    mode: "auto" fetches static pages over plain HTTP and uses a headless browser only for
+    pages that need JavaScript; "http" never starts a browser; "browser" always does.
+    extract: "all" returns all visible text; "main" returns only the main article body,
+    without navigation, sidebars, footers or banners.
+    Long pages come back one page at a time: the first page is returned here and
+    the rest can be read from the crawl://{doc_id}/{page} resource named at the end.
+    While a long page is cleaned, its text so far is also sent as crawl.partial log messages."""
+    if mode not in CRAWL_MODES:
+        return f"Error: mode must be one of {', '.join(CRAWL_MODES)}"
+    if extract not in CRAWL_EXTRACT_MODES:
+        return f"Error: extract must be one of {', '.join(CRAWL_EXTRACT_MODES)}"
     try:
-        async with AsyncWebCrawler() as crawler:
-            result = await crawler.arun(url=link)
-            if not result or not result[0].success:
-                error_msg = getattr(result[0], 'error_message', 'Unknown error') if result else 'No result returned'
-                return f"Crawl failed: {remove_unicode(str(error_msg))}"
-            
-            # Try to get extracted content first, fall back to HTML if not available
-            content = result[0].extracted_content or result[0].html
-            if not content:
-                return "Crawl succeeded but no content was returned."
-            
-            # Clean up the content: strip HTML, remove non-unicode chars, and truncate
-            cleaned = strip_html_tags(content)  # First strip HTML tags
-            cleaned = remove_unicode(cleaned)   # Then remove non-ASCII chars
-            cleaned = cleaned.strip()           # Remove leading/trailing whitespace
-            
-            if not cleaned:
-                return "Crawl succeeded but content was empty after cleaning."
-                
-            return truncate(cleaned)  # Finally truncate to size limit
+        cleaned, error = await _crawl_and_clean(link, CRAWL_DOCUMENT_MAX_BYTES, mode, extract, ctx)
+        await _report_progress(ctx, 2, 2, "Done")
+        if error:
+            return error
+        doc_id, pages = _crawl_documents.put(cleaned)
+        if pages == 1:
+            return cleaned
+        first_page, _ = _crawl_documents.page(doc_id, 1)
+        return f"{first_page}\n\n{_page_footer(doc_id, 1, pages)}"
             
     except Exception as e:
         return f"[crawl_web_truncated error] {type(e).__name__}: {remove_unicode(str(e))}"
+
+def _page_footer(doc_id: str, page: int, pages: int) -> str:
+    if page == pages:
+        return f"[Page {page} of {pages} of crawl://{doc_id}]"
+    return f"[Page {page} of {pages}. Read the next page from crawl://{doc_id}/{page + 1}]"
+
+# Add a resource that serves later pages of a crawled document
+@mcp.resource("crawl://{doc_id}/{page}")
+def get_crawl_page(doc_id: str, page: str) -> str:
+    """Get one page of a document crawled by crawl_web_truncated"""
+    try:
+        number = int(page)
+    except ValueError:
+        return f"Error: Invalid page number '{page}'"
+    found = _crawl_documents.page(doc_id, number)
+    if found is None:
+        return f"Error: No page {number} for crawl document '{doc_id}'. It may have expired; crawl the link again."
+    text, pages = found
+    return f"{text}\n\n{_page_footer(doc_id, number, pages)}"
         
+_SENTENCE_END_RE = re.compile(r"(?<=[.!?])\s+")
+
+def _content_chunks(text: str, max_bytes: int) -> list[str]:
+    """Split cleaned text into chunks of at most max_bytes at content-defined sentence ends.
+
+    A chunk may end after any sentence once it holds max_bytes / 2, but only
+    where the sentence hash says so. Boundaries depend on nearby text rather
+    than offsets, so an edit to one part of a page leaves other chunks intact.
+    """
+    min_bytes = max_bytes // 2
+    chunks: list[str] = []
+    current: list[str] = []
+    size = 0
+
+    def flush() -> None:
+        nonlocal current, size
+        if current:
+            chunks.append(" ".join(current))
+        current, size = [], 0
+
+    for sentence in _SENTENCE_END_RE.split(text):
+        # Cleaned text is ASCII, so characters are bytes
+        while len(sentence) > max_bytes:
+            flush()
+            chunks.append(sentence[:max_bytes])
+            sentence = sentence[max_bytes:]
+        if size + len(sentence) + 1 > max_bytes:
+            flush()
+        current.append(sentence)
+        size += len(sentence) + 1
+        if size >= min_bytes and zlib.crc32(sentence.encode("utf-8")) % 4 == 0:
+            flush()
+    flush()
+    return [chunk for chunk in chunks if chunk.strip()]
+
+async def _ask_model(ctx: Context, prompt: str) -> str:
+    """Send a prompt to the client's language model and return the reply text."""
+    ask_user = getattr(ctx, "ask_user", None)
+    if ask_user is not None:
+        return await ask_user(prompt) or ""
+    result = await ctx.session.create_message(
+        messages=[SamplingMessage(role="user", content=TextContent(type="text", text=prompt))],
+        max_tokens=SUMMARY_MAX_TOKENS,
+    )
+    return result.content.text if isinstance(result.content, TextContent) else ""
+
+def _text_hash(text: str) -> str:
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+
+async def _memoized_summary(ctx: Context, kind: str, text: str, prompt: str) -> str:
+    """Ask for a summary of text unless one was already produced for identical text."""
+    key = f"{kind}:{_text_hash(text)}"
+    summary = _summary_cache.get(key)
+    if summary is _MISSING or summary is None:
+        summary = remove_unicode((await _ask_model(ctx, prompt)).strip())
+        if summary:
+            _summary_cache.set(key, summary)
+    return summary
+
+async def _summarize_document(ctx: Context, link: str, text: str) -> str:
+    """Map-reduce summary of a page, reusing what is known from the last summary of link.
+
+    Unchanged pages return the previous summary at once, and a page first
+    seen as a close copy of an already summarized page on the same host (a
+    query-string variant) reuses that page's summary. Otherwise chunks are
+    summarized concurrently (skipping those the previous version already had),
+    and either folded into the previous summary, when only a few chunks
+    changed, or merged from scratch in one request.
+    """
+    key = _normalize_url(link)
+    text_hash = _text_hash(text)
+    previous = _page_summaries.get(key)
+    previous = previous if isinstance(previous, dict) else None
+    if previous and previous["hash"] == text_hash:
+        return previous["summary"]
+    fingerprint = simhash(text)
+    if previous is None:
+        # Templated pages with short bodies can be a few bits apart, so only a close copy
+        # on the same host borrows a summary (identical text hits _summary_cache anyway)
+        for original in _page_fingerprints.near(fingerprint, SUMMARY_REUSE_MAX_DISTANCE):
+            copied = _page_summaries.get(original)
+            if original != key and _site_host(original) == _site_host(key) and isinstance(copied, dict):
+                _page_summaries.set(key, {**copied, "hash": text_hash})
+                return f"(Near-duplicate of {original}, summarized earlier)\n{copied['summary']}"
+    _page_fingerprints.add(fingerprint, key)
+
+    chunks = _content_chunks(text, SUMMARY_CHUNK_BYTES)
+    if len(chunks) <= 1:
+        summary = await _memoized_summary(ctx, "page", text, (
+            f"Please provide a comprehensive summary of the following webpage content. "
+            f"Focus on the main points, key information, and important details:\n\n{text}"
+        ))
+        if summary:
+            _page_summaries.set(key, {"hash": text_hash, "blocks": [[text_hash, summary]], "summary": summary})
+        return summary
+
+    old_blocks = previous["blocks"] if previous else []
+    known = {block_hash: summary for block_hash, summary in old_blocks if summary}
+    hashes = [_text_hash(chunk) for chunk in chunks]
+    semaphore = asyncio.Semaphore(SUMMARY_CONCURRENCY)
+    done = 0
+
+    async def summarize_chunk(chunk: str, chunk_hash: str) -> str:
+        nonlocal done
+        if chunk_hash in known:
+            summary = known[chunk_hash]
+        else:
+            async with semaphore:
+                summary = await _memoized_summary(ctx, "chunk", chunk, (
+                    f"Please summarize the following excerpt of a webpage. "
+                    f"Focus on the main points, key information, and important details:\n\n{chunk}"
+                ))
+        done += 1
+        # Step 2 of the summarize tool's fetch / clean / summarize progress
+        await _report_progress(ctx, 2 + done / (len(chunks) + 1), 3, f"Summarized part {done} of {len(chunks)}")
+        return summary
+
+    summaries = await asyncio.gather(*(summarize_chunk(c, h) for c, h in zip(chunks, hashes)))
+
+    # Block-level diff against the previous version of the page
+    added: list[str] = []
+    removed: list[str] = []
+    matcher = difflib.SequenceMatcher(None, [block_hash for block_hash, _ in old_blocks], hashes, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag != "equal":
+            removed.extend(summary for _, summary in old_blocks[i1:i2] if summary)
+            added.extend(summary for summary in summaries[j1:j2] if summary)
+
+    if previous and len(added) + len(removed) <= len(chunks) * SUMMARY_INCREMENTAL_MAX_CHANGE:
+        removed_text = "\n".join(removed) or "(none)"
+        added_text = "\n".join(added) or "(none)"
+        summary = remove_unicode((await _ask_model(ctx, (
+            f"Below is a summary of a webpage, followed by summaries of the sections that changed since "
+            f"it was written. Update the summary: drop information that only came from removed sections, "
+            f"add the new information, and keep everything else. Reply with the full updated summary.\n\n"
+            f"Current summary:\n{previous['summary']}\n\n"
+            f"Removed sections:\n{removed_text}\n\n"
+            f"New or changed sections:\n{added_text}"
+        ))).strip())
+    else:
+        present = [summary for summary in summaries if summary]
+        if len(present) <= 1:
+            summary = present[0] if present else ""
+        else:
+            parts = "\n\n".join(f"Part {i}:\n{summary}" for i, summary in enumerate(present, start=1))
+            summary = await _memoized_summary(ctx, "merge", parts, (
+                f"The following are summaries of consecutive parts of one webpage. Combine them into a single "
+                f"comprehensive summary of the whole page, keeping the main points, key information, and "
+                f"important details:\n\n{parts}"
+            ))
+    if summary:
+        _page_summaries.set(key, {"hash": text_hash, "blocks": [list(b) for b in zip(hashes, summaries)], "summary": summary})
+    return summary
+
 # Add a crawl_web tool that summarizes and truncates
 @mcp.tool()
 async def crawl_web_summarize_and_truncate(link: str, ctx: Context) -> str:
     """Crawl the page, clean its content, generate a summary, and truncate the result."""
     try:
-        async with AsyncWebCrawler() as crawler:
-            result = await crawler.arun(url=link)
-            if not result or not result[0].success:
-                error_msg = getattr(result[0], 'error_message', 'Unknown error') if result else 'No result returned'
-                return f"Crawl failed: {remove_unicode(str(error_msg))}"
-            
-            # Try to get extracted content first, fall back to HTML if not available
-            content = result[0].extracted_content or result[0].html
-            if not content:
-                return "Crawl succeeded but no content was returned."
-            
-            # Clean up the content before summarization
-            cleaned = strip_html_tags(content)  # First strip HTML tags
-            cleaned = remove_unicode(cleaned)   # Then remove non-ASCII chars
-            cleaned = cleaned.strip()           # Remove leading/trailing whitespace
-            
-            if not cleaned:
-                return "Crawl succeeded but content was empty after cleaning."
-            
-            # Truncate before sending for summarization to avoid overloading
-            truncated = truncate(cleaned, 3000)
-            
-            # Generate a summary with help from the language model
-            summary_prompt = (
-                f"Please provide a comprehensive summary of the following webpage content. "
-                f"Focus on the main points, key information, and important details:\n\n{truncated}"
-            )
-            summary = await ctx.ask_user(summary_prompt)
+        # Long pages are summarized in chunks, so the summary covers the whole page
+        # Progress steps: fetch, clean, summarize
+        cleaned, error = await _crawl_and_clean(link, SUMMARY_MAX_INPUT_BYTES, ctx=ctx, total=3)
+        if error:
+            return error
+        
+        # Generate a summary with help from the language model
+        await _report_progress(ctx, 2, 3, "Summarizing")
+        summary = await _summarize_document(ctx, link, cleaned)
+        await _report_progress(ctx, 3, 3, "Done")
+        
+        if not summary:
+            return "Failed to generate summary."
             
-            if not summary:
-                return "Failed to generate summary."
-                
-            # Clean up the summary and truncate to size limit
-            cleaned_summary = remove_unicode(summary.strip())
-            return truncate(cleaned_summary)
+        # Truncate the summary to the size limit
+        return truncate(summary)
             
     except Exception as e:
         return f"[crawl_web_summarize_and_truncate error] {type(e).__name__}: {remove_unicode(str(e))}"
 
 
 
+_WORD_RE = re.compile(r"\w+")
+
+def simhash(text: str) -> int:
+    """64-bit SimHash of text over 3-word shingles; near-identical texts differ in few bits."""
+    words = _WORD_RE.findall(text.lower())
+    shingles = {" ".join(words[i:i + 3]) for i in range(max(len(words) - 2, 1))}
+    bits = "".join([
+        format(int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest(), "big"), "064b")
+        for shingle in shingles
+    ])
+    # Bit i of the fingerprint is set when most shingle hashes have it set
+    half = len(shingles) / 2
+    return int("".join("1" if bits[i::64].count("1") > half else "0" for i in range(64)), 2)
+
+class SimHashIndex:
+    """Near-duplicate lookup over 64-bit SimHash fingerprints.
+
+    Fingerprints are split into max_distance + 1 bands and filed under each
+    of them. Two fingerprints at most max_distance bits apart must agree on
+    at least one band, so a lookup only compares against the entries sharing
+    a band with it. The default of 7 bits catches small pages with a few
+    edits; unrelated pages are typically 20 or more bits apart. Each label
+    has one fingerprint, and with a maxsize the oldest labels are dropped.
+    """
+
+    def __init__(self, max_distance: int = 7, maxsize: int | None = None):
+        self.max_distance = max_distance
+        self.maxsize = maxsize
+        self._band_bits = 64 // (max_distance + 1)
+        self._bands: list[dict[int, list[tuple[int, Any]]]] = [{} for _ in range(max_distance + 1)]
+        self._labels: OrderedDict[Any, int] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._labels)
+
+    def _keys(self, fingerprint: int) -> Iterator[tuple[dict, int]]:
+        mask = (1 << self._band_bits) - 1
+        for band, table in enumerate(self._bands):
+            yield table, (fingerprint >> (self._band_bits * band)) & mask
+
+    def near(self, fingerprint: int, max_distance: int | None = None) -> Iterator[Any]:
+        """Labels of indexed fingerprints at most max_distance (default: the index's) bits away."""
+        limit = self.max_distance if max_distance is None else min(max_distance, self.max_distance)
+        found = set()
+        for table, key in self._keys(fingerprint):
+            for other, label in table.get(key, ()):
+                if (fingerprint ^ other).bit_count() <= limit and label not in found:
+                    found.add(label)
+                    yield label
+
+    def find(self, fingerprint: int, exclude: Any = None) -> Any:
+        """Label of an indexed near-duplicate of fingerprint (other than exclude), or None."""
+        return next((label for label in self.near(fingerprint) if label != exclude), None)
+
+    def add(self, fingerprint: int, label: Any) -> None:
+        """Index fingerprint under label, replacing the label's previous fingerprint."""
+        if label in self._labels:
+            self._remove(label)
+        self._labels[label] = fingerprint
+        for table, key in self._keys(fingerprint):
+            table.setdefault(key, []).append((fingerprint, label))
+        if self.maxsize is not None and len(self._labels) > self.maxsize:
+            self._remove(next(iter(self._labels)))
+
+    def clear(self) -> None:
+        for table in self._bands:
+            table.clear()
+        self._labels.clear()
+
+    def _remove(self, label: Any) -> None:
+        fingerprint = self._labels.pop(label)
+        for table, key in self._keys(fingerprint):
+            bucket = table[key]
+            bucket.remove((fingerprint, label))
+            if not bucket:
+                del table[key]
+
+    def check(self, text: str, label: Any) -> Any:
+        """Label of an earlier near-duplicate of text, or None after indexing text under label."""
+        fingerprint = simhash(text)
+        original = self.find(fingerprint)
+        if original is None:
+            self.add(fingerprint, label)
+        return original
+
+# Fingerprints of pages returned by earlier calls, keyed by normalised URL, so repeated
+# batch crawls and summaries also recognise mirrors and variants of pages seen before
+_page_fingerprints = SimHashIndex(maxsize=CRAWL_FINGERPRINTS_SIZE)
+
+def _check_duplicate(duplicates: SimHashIndex, text: str, label: Any, url: str) -> tuple[Any, str | None]:
+    """Return (label of a near-duplicate earlier in this call, URL of one from an earlier call).
+
+    Text that is neither is indexed in duplicates under label and in
+    _page_fingerprints under url; a page never counts as a copy of itself.
+    The caller may never have seen what an earlier call returned, so a match
+    from one is only worth a note next to the text.
+    """
+    fingerprint = simhash(text)
+    key = _normalize_url(url)
+    original = duplicates.find(fingerprint)
+    if original is not None:
+        return original, None
+    duplicates.add(fingerprint, label)
+    earlier = _page_fingerprints.find(fingerprint, exclude=key)
+    if earlier is None:
+        _page_fingerprints.add(fingerprint, key)
+    return None, earlier
+
+# Add a tool that crawls many pages in one call
+@mcp.tool()
+async def crawl_many(links: list[str], ctx: Context = None) -> str:
+    """Crawl several web pages concurrently and return each page's cleaned, truncated text as it finishes.
+    Pages that are near-duplicates of an earlier one in this call are listed without their text
+    (crawl_web_truncated returns any page in full); copies of pages from previous calls are noted."""
+    # Repeated links (after URL normalisation) are crawled once
+    unique: dict[str, str] = {}
+    for link in links:
+        unique.setdefault(_normalize_url(link), link)
+    if not unique:
+        return "Error: Please provide at least one link"
+    if len(unique) > CRAWL_MANY_MAX_LINKS:
+        return f"Error: At most {CRAWL_MANY_MAX_LINKS} links can be crawled per call"
+
+    # Pages share the overall size limit
+    budget = MAX_RESULT_BYTES // len(unique)
+    index = {link: i for i, link in enumerate(unique.values(), start=1)}
+    sections: list[str] = []
+    # Mirrors and query-string variants come back as a pointer to the first copy
+    duplicates = SimHashIndex()
+
+    async def add_section(link: str, text: str, error: str | None) -> None:
+        original, earlier = (None, None) if error else _check_duplicate(duplicates, text, link, link)
+        if original is not None:
+            text = f"Near-duplicate of [{index[original]}] {original}"
+        elif earlier is not None:
+            text = f"(Near-duplicate of {earlier}, crawled earlier)\n{text}"
+        sections.append(f"[{index[link]}] {link}\n{error or text}")
+        # Each page goes out as soon as it is ready
+        await _send_partial(ctx, sections[-1])
+        await _report_progress(ctx, len(sections), len(index), f"Crawled {link}")
+
+    try:
+        cached = await asyncio.gather(*(_cached_crawl_text(link, budget) for link in index))
+        pending = []
+        for link, text in zip(index, cached):
+            if text is None:
+                pending.append(link)
+            else:
+                await add_section(link, text, None)
+
+        if pending:
+            # crawl4ai's multi-URL mode: one browser, bounded concurrency, per-domain delays
+            dispatcher = SemaphoreDispatcher(
+                semaphore_count=CRAWL_MANY_CONCURRENCY,
+                rate_limiter=RateLimiter(base_delay=(CRAWL_DOMAIN_DELAY, CRAWL_DOMAIN_DELAY * 2)),
+            )
+            remaining = {_normalize_url(link): link for link in pending}
+            step = max(CRAWL_MANY_LEASE_PAGES, 1)
+            for start in range(0, len(pending), step):
+                async with _crawler_session() as crawler:
+                    results = await crawler.arun_many(pending[start:start + step], config=CrawlerRunConfig(stream=True),
+                                                      dispatcher=dispatcher)
+                    async for result in results:
+                        link = remaining.pop(_normalize_url(result.url), None)
+                        if link is not None:
+                            await add_section(link, *await _clean_crawl_result(link, result, budget))
+            for link in remaining.values():
+                await add_section(link, "", "Crawl failed: No result returned")
+    except Exception as e:
+        sections.append(f"[crawl_many error] {type(e).__name__}: {remove_unicode(str(e))}")
+
+    return "\n\n".join(sections)
+
+class SeenURLs:
+    """Compact seen-set for a crawl frontier: canonical URLs kept as 64-bit BLAKE2b hashes."""
+
+    def __init__(self):
+        self._hashes: set[int] = set()
+
+    def __len__(self) -> int:
+        return len(self._hashes)
+
+    def add(self, url: str) -> bool:
+        """Record url; False if it (or a hash collision, ~1 in 10^19) was seen before."""
+        digest = int.from_bytes(hashlib.blake2b(url.encode("utf-8"), digest_size=8).digest(), "big")
+        if digest in self._hashes:
+            return False
+        self._hashes.add(digest)
+        return True
+
+
+_HREF_RE = re.compile(r"""<a\s[^>]*?href\s*=\s*["']?([^"'\s>]+)""", re.IGNORECASE)
+_TITLE_RE = re.compile(r"<title[^>]*>([^<]*)</title>", re.IGNORECASE)
+# Links to these are files, not pages worth crawling
+_ASSET_EXTENSIONS = (
+    ".7z", ".avi", ".css", ".csv", ".doc", ".docx", ".gif", ".gz", ".ico", ".jpeg", ".jpg", ".js",
+    ".json", ".mov", ".mp3", ".mp4", ".pdf", ".png", ".rss", ".svg", ".tar", ".tgz", ".webp",
+    ".xls", ".xlsx", ".xml", ".zip",
+)
+
+def _page_links(result: Any) -> list[str]:
+    """Absolute http(s) links found on a crawled page."""
+    links = getattr(result, "links", None)
+    hrefs: list[str] = []
+    if isinstance(links, dict) and links:
+        for group in ("internal", "external"):
+            for item in links.get(group) or []:
+                href = item.get("href") if isinstance(item, dict) else item
+                if href:
+                    hrefs.append(href)
+    else:
+        hrefs = _HREF_RE.findall(result.html or "")
+    absolute = (urljoin(result.url, htmllib.unescape(href)) for href in hrefs)
+    return [url for url in absolute if urlsplit(url).scheme in ("http", "https")]
+
+def _page_title(result: Any, fallback: str) -> str:
+    metadata = getattr(result, "metadata", None)
+    title = metadata.get("title") if isinstance(metadata, dict) else None
+    if not title:
+        match = _TITLE_RE.search(result.html or "", 0, 200_000)
+        title = htmllib.unescape(match.group(1)) if match else ""
+    title = " ".join(remove_unicode(str(title)).split())
+    return title or fallback
+
+def _site_host(url: str) -> str:
+    host = urlsplit(url).hostname or ""
+    return host[4:] if host.startswith("www.") else host
+
+# Add a tool that crawls a site breadth-first from a seed page
+@mcp.tool()
+async def crawl_site(link: str, max_pages: int = 10, max_depth: int = 2, same_domain: bool = True,
+                     ctx: Context = None) -> str:
+    """Crawl a site breadth-first from a seed page, following links up to max_depth.
+    Returns an index of page titles followed by each page's cleaned text; near-duplicates of
+    pages earlier in the crawl are marked in the index and their text and links are skipped."""
+    max_pages = max(1, min(max_pages, CRAWL_SITE_MAX_PAGES))
+    max_depth = max(0, min(max_depth, CRAWL_SITE_MAX_DEPTH))
+    seed = _normalize_url(link)
+    seed_host = _site_host(seed)
+    budget = MAX_RESULT_BYTES // max_pages
+
+    frontier: asyncio.Queue[tuple[int, str, int]] = asyncio.Queue()
+    seen = SeenURLs()
+    duplicates = SimHashIndex()
+    pages: dict[int, dict] = {}
+    scheduled = 0
+
+    def schedule(url: str, depth: int) -> None:
+        nonlocal scheduled
+        if scheduled >= max_pages:
+            return
+        url = _normalize_url(url)
+        if same_domain and _site_host(url) != seed_host:
+            return
+        if urlsplit(url).path.lower().endswith(_ASSET_EXTENSIONS) or not seen.add(url):
+            return
+        scheduled += 1
+        frontier.put_nowait((scheduled, url, depth))
+
+    async def visit(order: int, url: str, depth: int) -> None:
+        try:
+            # One lease per page: an idle worker waiting on the frontier holds no browser
+            async with _crawler_session() as crawler:
+                result = await crawler.arun(url=url)
+            result = result[0] if result else None
+        except Exception as e:
+            pages[order] = {"url": url, "depth": depth, "title": url, "text": "", "error": f"{type(e).__name__}: {remove_unicode(str(e))}"}
+            return
+        if result is None:
+            pages[order] = {"url": url, "depth": depth, "title": url, "text": "", "error": "Crawl failed: No result returned"}
+            return
+        text, error = await _clean_crawl_result(url, result, budget)
+        original, earlier = (None, None) if error else _check_duplicate(duplicates, text, url, url)
+        duplicate = original is not None
+        if duplicate:
+            # Templates and mirrors within this crawl: keep the entry, drop the repeated text and its links
+            text = f"Near-duplicate of {original}"
+        elif earlier is not None:
+            text = f"(Near-duplicate of {earlier}, crawled earlier)\n{text}"
+        pages[order] = {"url": url, "depth": depth, "title": _page_title(result, url) if result.success else url,
+                        "text": text, "error": error, "duplicate": duplicate}
+        await _send_partial(ctx, f"{pages[order]['title']}\n{url}\n{error or text}")
+        if result.success and not duplicate and depth < max_depth:
+            for next_url in _page_links(result):
+                schedule(next_url, depth + 1)
+
+    async def worker() -> None:
+        while True:
+            order, url, depth = await frontier.get()
+            try:
+                await visit(order, url, depth)
+                # The frontier is still growing, so progress is measured against max_pages
+                await _report_progress(ctx, len(pages), max_pages, f"Crawled {url}")
+            finally:
+                frontier.task_done()
+
+    schedule(seed, 0)
+    workers = [asyncio.create_task(worker()) for _ in range(min(CRAWL_SITE_CONCURRENCY, max_pages))]
+    try:
+        # Stop when the frontier drains, or if every worker died
+        join = asyncio.create_task(frontier.join())
+        waiting = {join, *workers}
+        while not join.done() and not all(w.done() for w in workers):
+            _, waiting = await asyncio.wait(waiting, return_when=asyncio.FIRST_COMPLETED)
+        join.cancel()
+    finally:
+        for w in workers:
+            w.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+    if not pages:
+        failures = [w.exception() for w in workers if not w.cancelled() and w.exception()]
+        reason = f"{type(failures[0]).__name__}: {remove_unicode(str(failures[0]))}" if failures else "no pages crawled"
+        return f"[crawl_site error] {reason}"
+
+    ordered = [pages[order] for order in sorted(pages)]
+    index = "\n".join(
+        f"{i}. {page['title']} - {page['url']} (depth {page['depth']})"
+        f"{' [failed]' if page['error'] else ' [duplicate]' if page.get('duplicate') else ''}"
+        for i, page in enumerate(ordered, start=1)
+    )
+    sections = "\n\n".join(
+        f"[{i}] {page['title']}\n{page['url']}\n{page['error'] or page['text']}"
+        for i, page in enumerate(ordered, start=1)
+    )
+    return truncate(f"Crawled {len(ordered)} pages from {seed}\n\nIndex:\n{index}\n\n{sections}")
+
+def encode_thumbnail(image_data: bytes, max_width: int, format: str = "webp",
+                     max_bytes: int = SCREENSHOT_MAX_BYTES) -> bytes:
+    """Downscale an image to max_width and encode it as WebP or JPEG within max_bytes.
+
+    Quality drops step by step first; if the lowest quality is still too big,
+    the width shrinks by a quarter and the qualities are tried again, down to
+    SCREENSHOT_MIN_WIDTH (whose smallest encoding is returned regardless).
+    """
+    with PILImage.open(io.BytesIO(image_data)) as opened:
+        # Screenshots are opaque, and JPEG has no alpha channel
+        image = opened.convert("RGB")
+    max_height = int(image.width * SCREENSHOT_MAX_ASPECT)
+    if image.height > max_height:
+        image = image.crop((0, 0, image.width, max_height))
+    width = min(max_width, image.width)
+    while True:
+        scaled = image
+        if width < image.width:
+            height = max(1, round(image.height * width / image.width))
+            scaled = image.resize((width, height), PILImage.Resampling.LANCZOS, reducing_gap=3.0)
+        for quality in (80, 65, 50, 35):
+            buffer = io.BytesIO()
+            if format == "webp":
+                scaled.save(buffer, "WEBP", quality=quality, method=4)
+            else:
+                scaled.save(buffer, "JPEG", quality=quality, optimize=True, progressive=True)
+            if buffer.tell() <= max_bytes:
+                return buffer.getvalue()
+        if width <= SCREENSHOT_MIN_WIDTH:
+            return buffer.getvalue()
+        width = max(SCREENSHOT_MIN_WIDTH, width * 3 // 4)
+
+# Add a tool that takes a compact screenshot of a web page
+@mcp.tool()
+async def crawl_screenshot(link: str, max_width: int = 1024, format: str = "webp") -> Image:
+    """Take a screenshot of a web page and return it as a small WebP or JPEG image
+    (format "webp" or "jpeg"), at most max_width pixels wide and about 100 KB.
+    Very long pages keep their top part."""
+    format = "jpeg" if format.lower() == "jpg" else format.lower()
+    if format not in SCREENSHOT_FORMATS:
+        return f"Error: format must be one of {', '.join(SCREENSHOT_FORMATS)}"
+    max_width = max(SCREENSHOT_MIN_WIDTH, min(max_width, SCREENSHOT_MAX_WIDTH))
+    key = f"{_normalize_url(link)} {max_width} {format}"
+    data = _screenshot_cache.get(key)
+    if data is _MISSING:
+        try:
+            async with _crawler_session() as crawler:
+                result = await crawler.arun(url=link, config=CrawlerRunConfig(screenshot=True))
+            if not result:
+                return "Screenshot failed: No result returned"
+            if not result[0].success:
+                error_msg = getattr(result[0], 'error_message', 'Unknown error')
+                return f"Screenshot failed: {remove_unicode(str(error_msg))}"
+            if not result[0].screenshot:
+                return "Screenshot failed: the crawler returned no image"
+            # Decoding and re-encoding a multi-megabyte capture is CPU work, so it runs in a thread
+            data = await asyncio.to_thread(
+                encode_thumbnail, base64.b64decode(result[0].screenshot), max_width, format, SCREENSHOT_MAX_BYTES
+            )
+        except Exception as e:
+            return f"[crawl_screenshot error] {type(e).__name__}: {remove_unicode(str(e))}"
+        _screenshot_cache.set(key, data, time.time() + SCREENSHOT_CACHE_TTL)
+    return Image(data=data, format=format)
+
+
+
 #################################################
 ##################### NOTES #####################
 #################################################
@@ -295,31 +2073,255 @@ def ensure_file_exists():
         with open(NOTES_FILE, "w") as f:
             f.write("")
 
+class NotesLog:
+    """The notes file as an append-only log of lines, with a sidecar index for seeks.
+
+    The index (path + ".idx") holds the end offset of every line as a
+    little-endian uint64, so any line or range of lines is two index reads
+    and one log read away, whatever the size of the file. The log is
+    written before the index: lines found past the last indexed offset
+    (after a crash, or in a notes file from before the index existed) are
+    indexed on the next access, and a log that shrank is re-indexed.
+    """
+
+    _ENTRY = struct.Struct("<Q")
+    _BLOCK = 1 << 20
+
+    def __init__(self, path: str):
+        self.path = path
+        self.index_path = path + ".idx"
+        self._indexed = 0
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self.sync()
+
+    def sync(self) -> int:
+        """Index lines the index does not cover yet and return the line count."""
+        for path in (self.path, self.index_path):
+            if not os.path.exists(path):
+                open(path, "ab").close()
+        self._size = os.path.getsize(self.path)
+        with open(self.index_path, "r+b") as index:
+            entries, torn = divmod(index.seek(0, os.SEEK_END), self._ENTRY.size)
+            end = self._end(index, entries - 1) if entries else 0
+            rewritten = end > self._size
+            if rewritten:
+                # The log shrank, so it was not only appended to: index it again
+                entries, end = 0, 0
+            if torn or rewritten:
+                index.truncate(entries * self._ENTRY.size)
+            if end < self._size:
+                index.seek(entries * self._ENTRY.size)
+                with open(self.path, "rb") as log:
+                    log.seek(end)
+                    blocks = iter(lambda: log.read(self._BLOCK), b"")
+                    entries, end = self._index_lines(index, blocks, entries, end)
+        self._indexed = entries
+        # A last line without its newline (a hand edit) counts, but stays out of the index
+        return entries + (end < self._size)
+
+    @property
+    def complete(self) -> int:
+        """Lines that end with a newline as of the last sync (all of them, barring hand edits)."""
+        return self._indexed
+
+    def lines(self, start: int = 0, stop: int | None = None) -> list[str]:
+        """Lines start to stop, counted like a slice (negative numbers count from the end)."""
+        start, stop, _ = slice(start, stop).indices(self.sync())
+        if start >= stop:
+            return []
+        with open(self.index_path, "rb") as index:
+            begin = self._end(index, start - 1) if start else 0
+            end = self._end(index, stop - 1) if stop <= self._indexed else self._size
+        with open(self.path, "rb") as log:
+            log.seek(begin)
+            text = log.read(end - begin).decode("utf-8", errors="replace")
+        return [line.rstrip("\r") for line in text.removesuffix("\n").split("\n")]
+
+    def append(self, message: str) -> None:
+        """Append message as one or more lines and index them."""
+        count = self.sync()
+        data = f"{message}\n".encode("utf-8")
+        if count > self._indexed:
+            data = b"\n" + data  # end the unterminated last line first
+        with open(self.path, "ab") as log:
+            log.write(data)
+        with open(self.index_path, "r+b") as index:
+            index.seek(self._indexed * self._ENTRY.size)
+            self._index_lines(index, (data,), self._indexed, self._size)
+
+    def _end(self, index: Any, line: int) -> int:
+        index.seek(line * self._ENTRY.size)
+        return self._ENTRY.unpack(index.read(self._ENTRY.size))[0]
+
+    @classmethod
+    def _index_lines(cls, index: Any, blocks: Iterable[bytes], entries: int, offset: int) -> tuple[int, int]:
+        """Write the end offset of every line in blocks (read from offset on); return (entries, last end)."""
+        end = offset
+        for block in blocks:
+            ends = []
+            position = block.find(b"\n")
+            while position != -1:
+                ends.append(offset + position + 1)
+                position = block.find(b"\n", position + 1)
+            if ends:
+                index.write(struct.pack(f"<{len(ends)}Q", *ends))
+                entries, end = entries + len(ends), ends[-1]
+            offset += len(block)
+        return entries, end
+
+class NotesSearchIndex:
+    """SQLite FTS5 index of a notes log (path + ".fts"), ranked by bm25.
+
+    Rows are keyed by line number, from 1, and the index remembers how many
+    lines it holds, so catching up after an append, a crash or on first use
+    with an existing notes file indexes only the lines it has not seen. A
+    log with fewer lines than that is indexed again from scratch.
+    """
+
+    _SCHEMA = (
+        "CREATE VIRTUAL TABLE IF NOT EXISTS notes USING fts5(text, tokenize = 'porter unicode61')",
+        "CREATE TABLE IF NOT EXISTS indexed (id INTEGER PRIMARY KEY CHECK (id = 0), lines INTEGER NOT NULL)",
+    )
+    _BATCH = 10_000
+
+    def __init__(self, log: NotesLog):
+        self.log = log
+        self.path = log.path + ".fts"
+
+    def update(self) -> None:
+        """Index the lines added to the log since the last update."""
+        with closing(self._connect()) as db:
+            self._update(db)
+
+    def search(self, query: str, limit: int) -> list[tuple[int, str]]:
+        """Return (line number, snippet) for the notes best matching any word of query, newest first on ties."""
+        terms = _WORD_RE.findall(query)
+        if not terms:
+            return []
+        # Quoted, so words that are FTS5 operators (AND, NEAR...) or column names are plain words
+        match = " OR ".join(f'"{term}"' for term in terms)
+        with closing(self._connect()) as db:
+            self._update(db)
+            rows = db.execute(
+                "SELECT rowid, snippet(notes, 0, '', '', '...', 24) FROM notes WHERE notes MATCH ? "
+                "ORDER BY bm25(notes), rowid DESC LIMIT ?",
+                (match, limit),
+            ).fetchall()
+        return [(number, text) for number, text in rows]
+
+    def _connect(self) -> sqlite3.Connection:
+        db = sqlite3.connect(self.path)
+        for statement in self._SCHEMA:
+            db.execute(statement)
+        return db
+
+    def _update(self, db: sqlite3.Connection) -> None:
+        self.log.sync()
+        lines = self.log.complete
+        row = db.execute("SELECT lines FROM indexed").fetchone()
+        done = row[0] if row else 0
+        if done == lines:
+            return
+        if done > lines:
+            db.execute("DELETE FROM notes")
+            done = 0
+        for start in range(done, lines, self._BATCH):
+            batch = self.log.lines(start, min(start + self._BATCH, lines))
+            db.executemany("INSERT INTO notes (rowid, text) VALUES (?, ?)",
+                           ((start + i + 1, text) for i, text in enumerate(batch)))
+        db.execute("INSERT OR REPLACE INTO indexed (id, lines) VALUES (0, ?)", (lines,))
+        db.commit()
+
 # add a tool that is adding notes to a file
 @mcp.tool()
 def add_note_to_file(message: str) -> str:
     """ append a new note to a sticky note file """
     ensure_file_exists()
-    with open(NOTES_FILE, "a") as f:
-        f.write(f"{message}\n")
+    log = NotesLog(NOTES_FILE)
+    log.append(message)
+    try:
+        NotesSearchIndex(log).update()
+    except sqlite3.Error as e:
+        # The note is saved; the search index catches up on its next use
+        print(f"Could not update the notes search index: {e}", file=sys.stderr)
     return "A note was saved!"
 
+# add a tool that searches the notes
+@mcp.tool()
+def search_notes(query: str, limit: int = 10) -> str:
+    """ search the notes for any of the words in query, best matches first
+    Each result starts with its note number; read a whole note from notes://range/{n}/{n} """
+    if not 1 <= limit <= NOTES_SEARCH_MAX_LIMIT:
+        return f"Error: limit must be between 1 and {NOTES_SEARCH_MAX_LIMIT}"
+    if not _WORD_RE.search(query):
+        return "Error: query must contain at least one word"
+    ensure_file_exists()
+    try:
+        results = NotesSearchIndex(NotesLog(NOTES_FILE)).search(query, limit)
+    except sqlite3.Error as e:
+        # Most likely a SQLite build without the FTS5 extension
+        return f"[search_notes error] {type(e).__name__}: {e}"
+    if not results:
+        return f"No notes match '{query}'"
+    return "\n".join(f"[{number}] {text}" for number, text in results)
+
 # add a tool that can read a file
 @mcp.tool()
-def read_note_in_a_file() -> str:
-    """ read the notes in a file """
+def read_note_in_a_file(offset: int = 0, limit: int = NOTES_READ_LIMIT, tail: int | None = None) -> str:
+    """ read the notes in a file, oldest first
+    offset: number of notes to skip; limit: number of notes to return
+    tail: return the last tail notes instead (offset is ignored)
+    When notes are left out, the last line says which ones and how to read them. """
+    if offset < 0 or limit < 1 or (tail is not None and tail < 1):
+        return "Error: offset must be 0 or more, limit and tail 1 or more"
+    ensure_file_exists()
+    log = NotesLog(NOTES_FILE)
+    count = log.sync()
+    limit = min(tail if tail is not None else limit, NOTES_READ_MAX_LIMIT)
+    start = max(count - limit, 0) if tail is not None else min(offset, count)
+    stop = min(start + limit, count)
+    content = truncate("\n".join(log.lines(start, stop)).strip())
+    if not content:
+        return "No notes could be read!"
+    if start == 0 and stop == count:
+        return content
+    return f"{content}\n\n{_notes_footer(start, stop, count)}"
+
+def _notes_footer(start: int, stop: int, count: int) -> str:
+    if stop == count:
+        return f"[Notes {start + 1}-{stop} of {count}]"
+    return (f"[Notes {start + 1}-{stop} of {count}. Read more with offset={stop} "
+            f"or from notes://range/{stop + 1}/{min(stop + stop - start, count)}]")
+
+# Add a resource that serves a range of notes
+@mcp.resource("notes://range/{start}/{end}")
+def get_notes_range(start: str, end: str) -> str:
+    """Get notes start to end, numbered from 1 and both included"""
+    try:
+        first, last = int(start), int(end)
+    except ValueError:
+        return f"Error: Invalid note range '{start}'-'{end}'"
+    if first < 1 or last < first:
+        return f"Error: Invalid note range {first}-{last}; notes are numbered from 1"
+    if last - first >= NOTES_READ_MAX_LIMIT:
+        return f"Error: At most {NOTES_READ_MAX_LIMIT} notes can be read at once"
     ensure_file_exists()
-    with open(NOTES_FILE, "r") as f:
-        content = f.read().strip()
-    return content if content else "No notes could be read!"
+    log = NotesLog(NOTES_FILE)
+    count = log.sync()
+    if first > count:
+        return f"Error: There are only {count} notes"
+    last = min(last, count)
+    content = truncate("\n".join(log.lines(first - 1, last)))
+    return f"{content}\n\n{_notes_footer(first - 1, last, count)}"
 
 @mcp.resource("notes://latest")
 def get_latest_notes() -> str:
     """ resource to get latest notes from a file """
     ensure_file_exists()
     try:
-        with open(NOTES_FILE, "r") as f:
-            lines = f.readlines()
+        lines = NotesLog(NOTES_FILE).lines(-1)
         return lines[-1].strip() if lines else "No notes yet!"
     except Exception as e:
         return f"Error reading notes: {str(e)}"
@@ -329,8 +2331,7 @@ def note_summary() -> str:
     """ generate a prompt to summarize the content of a file """
     ensure_file_exists()
     try:
-        with open(NOTES_FILE, "r") as f:
-            content = f.read().strip()
+        content = "\n".join(NotesLog(NOTES_FILE).lines()).strip()
         if not content:
             return "No notes yet!"
         return f"Please summarize these notes:\n\n{content}"
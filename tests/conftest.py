@@ -1,5 +1,7 @@
 import pytest
 
+import main
+
 # Configure pytest markers
 def pytest_configure(config):
     # Register asyncio marker
@@ -13,5 +15,20 @@ def pytest_configure(config):
         "tools: mark test as a tools test",
     )
 
+# Keep the on-disk caches out of the repo and start every test cold
+@pytest.fixture(autouse=True)
+def isolated_caches(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "CACHE_DB_FILE", str(tmp_path / "cache.sqlite3"))
+    # Never launch real browsers or worker processes from the lifespan in unit tests
+    monkeypatch.setattr(main, "CRAWLER_POOL_SIZE", 0)
+    monkeypatch.setattr(main, "CLEAN_WORKERS", 0)
+    for cache in (main._geocode_cache, main._nws_points_cache, main._summary_cache, main._page_summaries):
+        cache.clear_memory()
+    main._forecast_cache.clear()
+    main._crawl_documents.clear()
+    main._screenshot_cache.clear()
+    main._page_fingerprints.clear()
+    yield
+
 # Event loop configuration is now handled by pytest-asyncio directly
 # We don't need to define our own event_loop fixture anymore
@@ -1,3 +1,10 @@
+import asyncio
+import concurrent.futures
+import pickle
+import random
+import subprocess
+import sys
+import time
 import pytest
 import os
 import tempfile
@@ -8,12 +15,16 @@ from main import (
     add, usd_to_gbp, get_height_for_16_9, calculate_bmi,
     # Weather functions
     _get_wind_direction, fetch_US_weather, fetch_international_weather,
+    fetch_weather_batch,
     # Web crawler utilities
-    remove_unicode, strip_html_tags, truncate,
-    crawl_web_truncated, crawl_web_summarize_and_truncate,
+    remove_unicode, strip_html_tags, truncate, iter_html_text, clean_and_truncate,
+    crawl_web_truncated, crawl_web_summarize_and_truncate, crawl_many, crawl_site,
     # Notes functionality
-    ensure_file_exists, add_note_to_file, read_note_in_a_file,
+    ensure_file_exists, add_note_to_file, read_note_in_a_file, search_notes,
+    # Shared HTTP client
+    mcp, server_lifespan,
 )
+import main
 
 # Basic tools tests
 def test_add():
@@ -125,6 +136,45 @@ def test_strip_html_tags():
     print(f"Output: {result}")
     assert result == expected, f"Expected '{expected}', got '{result}'"
 
+def test_strip_html_tags_entities_and_blocks():
+    print("\nTesting entity decoding and block separation")
+    html = "<div>Fish &amp; chips</div><div>caf&#233; &lt;b&gt;</div><p>one</p><p>two</p><b>in</b><i>line</i>"
+    result = strip_html_tags(html)
+    print(f"Output: {result}")
+    assert result == "Fish & chips café <b> one two inline"
+
+    html = "<SCRIPT type='x'>var s = '</div>';</Script ><noscript>Enable JS</noscript><!-- <p>hidden</p> -->Visible"
+    assert strip_html_tags(html) == "Visible"
+
+def test_iter_html_text_is_chunk_invariant():
+    print("\nTesting incremental HTML extraction")
+    html = "<html><body>" + "<p>Hello &amp; <b>world</b></p><!-- c --><style>p{}</style>\n" * 200 + "</body></html>"
+    expected = strip_html_tags(html)
+    for chunk_size in (1, 3, 64, 4096):
+        result = "".join(iter_html_text(html, chunk_size))
+        assert result == expected, f"Chunk size {chunk_size} changed the output"
+    # A stray "<" pairs with whichever ">" follows it, and entities can straddle inline tags
+    stray = "<p>x<y</b> z <q<p>>w a&lt;b &am</b>p; c<!-- x<y -->d<r s</p>" * 3
+    expected = strip_html_tags(stray)
+    for cut in range(1, len(stray)):
+        result = "".join(iter_html_text(iter([stray[:cut], stray[cut:]])))
+        assert result == expected, f"Splitting at {cut} changed the output: {result!r}"
+    for chunk_size in (1, 2, 3, 7):
+        assert "".join(iter_html_text(stray, chunk_size)) == expected, f"Chunk size {chunk_size} changed the output"
+    # Chunks may also come from any iterable, e.g. a network stream
+    assert "".join(iter_html_text(iter(["<p>spl", "it &am", "p; text</p>"]))) == "split & text"
+
+def test_strip_html_tags_malformed_input_is_linear():
+    print("\nTesting malformed HTML does not backtrack")
+    import time
+    # Unclosed <script> openers made the old lazy regex rescan the remainder of the page each time
+    html = ("<script>x " + "lorem ipsum " * 8) * 20_000
+    start = time.perf_counter()
+    strip_html_tags(html)
+    elapsed = time.perf_counter() - start
+    print(f"2 MB malformed page cleaned in {elapsed:.3f}s")
+    assert elapsed < 1.0
+
 def test_truncate():
     print("\nTesting text truncation")
     # Test string that doesn't need truncation
@@ -142,6 +192,41 @@ def test_truncate():
     assert len(result.encode('utf-8')) <= 20 + len("\n...[truncated]")
     assert result.endswith("\n...[truncated]"), f"Expected output to end with '...[truncated]', got '{result[-15:]}'"
 
+def test_truncate_utf8_boundaries():
+    print("\nTesting UTF-8 safe truncation")
+    text = "日本語テキスト"  # 3 bytes per character
+    for max_bytes in range(0, 25):
+        expected = text.encode("utf-8")[:max_bytes].decode("utf-8", errors="ignore")
+        result = truncate(text, max_bytes)
+        if len(text.encode("utf-8")) > max_bytes:
+            expected += "\n...[truncated]"
+        assert result == expected, f"max_bytes={max_bytes}: got {result!r}"
+
+def test_clean_and_truncate_matches_pipeline():
+    print("\nTesting fused cleaning pipeline")
+    html = "<html><body>  <p>caf\u00e9 &amp; t\u00e9a</p>" + "<div>Lorem ipsum dolor</div>" * 50 + "</body></html>"
+    for max_bytes in (0, 5, 20, 100, 3000):
+        expected = truncate(remove_unicode(strip_html_tags(html)).strip(), max_bytes)
+        result = clean_and_truncate(html, max_bytes)
+        print(f"max_bytes={max_bytes}: {result[:40]!r}")
+        assert result == expected
+
+def test_clean_and_truncate_stops_early():
+    print("\nTesting cleaning stops once the byte budget is reached")
+    consumed = 0
+
+    def chunks():
+        nonlocal consumed
+        for _ in range(1000):
+            consumed += 1
+            yield "<p>" + "word " * 200 + "</p>"
+
+    result = clean_and_truncate(chunks(), 3000)
+    print(f"Chunks consumed: {consumed}")
+    assert result.endswith("\n...[truncated]")
+    assert len(result) == 3000 + len("\n...[truncated]")
+    assert consumed < 10, "Pipeline should stop parsing after the budget is filled"
+
 # Notes functionality tests
 def test_ensure_file_exists(tmp_path):
     print("\nTesting file existence check")
@@ -182,6 +267,87 @@ def test_read_note_in_a_file(tmp_path):
         print(f"Read result from file with content: {result}")
         assert result == "Test note\nSecond note"
 
+def test_notes_log_index(tmp_path):
+    print("\nTesting the indexed notes log")
+    test_file = tmp_path / "test_notes.txt"
+    # An existing notes file without an index is migrated on first access
+    test_file.write_text("".join(f"note {i}\n" for i in range(1000)))
+    with patch('main.NOTES_FILE', str(test_file)):
+        assert main.get_latest_notes() == "note 999"
+        index = tmp_path / "test_notes.txt.idx"
+        assert index.stat().st_size == 8 * 1000, "One uint64 end offset per line"
+
+        log = main.NotesLog(str(test_file))
+        assert log.lines(10, 13) == ["note 10", "note 11", "note 12"]
+        assert log.lines(-2) == ["note 998", "note 999"] and log.lines(2000) == []
+
+        add_note_to_file("two\nlines")
+        assert len(log) == 1002 and log.lines(-3) == ["note 999", "two", "lines"]
+        assert test_file.read_text().endswith("note 999\ntwo\nlines\n"), "The text format is unchanged"
+
+        # Lines appended behind the index's back (or before a crash) are picked up
+        with open(test_file, "a") as f:
+            f.write("by hand\nunterminated")
+        assert log.lines(-2) == ["by hand", "unterminated"]
+        add_note_to_file("after")
+        assert log.lines(-3) == ["by hand", "unterminated", "after"]
+
+        # A torn index entry is dropped and a rewritten log is re-indexed
+        with open(index, "ab") as f:
+            f.write(b"\x01\x02")
+        assert main.get_latest_notes() == "after"
+        test_file.write_text("fresh\n")
+        assert read_note_in_a_file() == "fresh" and index.stat().st_size == 8
+
+def test_read_notes_pages_and_tail(tmp_path):
+    print("\nTesting paginated and tail reads of notes")
+    test_file = tmp_path / "test_notes.txt"
+    test_file.write_text("".join(f"note {i}\n" for i in range(1, 501)))
+    with patch('main.NOTES_FILE', str(test_file)):
+        first = read_note_in_a_file()
+        print(f"Last line of the first page: {first.splitlines()[-1]}")
+        assert first.startswith("note 1\nnote 2\n") and "note 200\n" in first and "note 201" not in first
+        assert first.endswith("[Notes 1-200 of 500. Read more with offset=200 or from notes://range/201/400]")
+
+        assert read_note_in_a_file(offset=498) == "note 499\nnote 500\n\n[Notes 499-500 of 500]"
+        assert read_note_in_a_file(offset=10, limit=2).startswith("note 11\nnote 12\n\n[Notes 11-12 of 500.")
+        assert read_note_in_a_file(tail=3) == "note 498\nnote 499\nnote 500\n\n[Notes 498-500 of 500]"
+        assert read_note_in_a_file(offset=600) == "No notes could be read!"
+        assert read_note_in_a_file(limit=0).startswith("Error:")
+
+        assert main.get_notes_range("2", "3") == "note 2\nnote 3\n\n[Notes 2-3 of 500. Read more with offset=3 or from notes://range/4/5]"
+        assert main.get_notes_range("499", "900").startswith("note 499\nnote 500\n\n[Notes 499-500 of 500]")
+        assert main.get_notes_range("x", "2") == "Error: Invalid note range 'x'-'2'"
+        assert main.get_notes_range("501", "502") == "Error: There are only 500 notes"
+
+def test_search_notes(tmp_path):
+    print("\nTesting full-text search over notes")
+    test_file = tmp_path / "test_notes.txt"
+    filler = ["Buy milk and bread", "Call the plumber about the sink", "Review the quarterly budget"]
+    test_file.write_text("".join(f"{filler[i % 3]} ({i})\n" for i in range(3000)))
+    with patch('main.NOTES_FILE', str(test_file)):
+        # Existing notes are indexed on first use
+        start = time.perf_counter()
+        assert search_notes("plumber", limit=2) == "[2999] Call the plumber about the sink (2998)\n[2996] Call the plumber about the sink (2995)"
+        print(f"First search, indexing 3000 notes: {time.perf_counter() - start:.3f}s")
+
+        add_note_to_file("Deploy the crawler")
+        add_note_to_file("Crawler deploy failed on staging, rolled back")
+        start = time.perf_counter()
+        result = search_notes("crawler staging")
+        print(f"Search after adds: {time.perf_counter() - start:.4f}s\n{result}")
+        assert result == ("[3002] Crawler deploy failed on staging, rolled back\n"
+                          "[3001] Deploy the crawler"), "Notes matching more of the words rank first"
+        assert search_notes("deploying") == search_notes("deploy"), "Words are stemmed"
+        assert search_notes("NEAR OR") == "No notes match 'NEAR OR'", "Operators are searched as plain words"
+        assert search_notes("milk AND").startswith("[2998] Buy milk and bread (2997)")
+        assert search_notes("...") == "Error: query must contain at least one word"
+        assert search_notes("milk", limit=0).startswith("Error:")
+
+        # A rewritten notes file is indexed again
+        test_file.write_text("Only note about milk\n")
+        assert search_notes("milk") == "[1] Only note about milk"
+
 # Async Weather API Tests
 @pytest.mark.asyncio
 async def test_fetch_US_weather():
@@ -228,6 +394,7 @@ async def test_fetch_US_weather():
             }]
         }
     }
+    mock_forecast_response.headers = {}
     mock_forecast_response.raise_for_status = AsyncMock(side_effect=mock_raise_for_status)
 
     # Create mock async client
@@ -305,6 +472,7 @@ async def test_fetch_international_weather():
             "wind_direction_10m": 270
         }
     }
+    mock_weather_response.headers = {}
     mock_weather_response.raise_for_status = AsyncMock(side_effect=mock_raise_for_status)
 
     # Create mock async client
@@ -348,7 +516,890 @@ async def test_fetch_international_weather():
         print(f"Error case result:\n{result}")
         assert "Error:" in result
 
+@pytest.mark.asyncio
+async def test_server_lifespan_shares_http_client():
+    print("\nTesting shared HTTP client lifespan")
+    assert main._http_client is None, "No shared client should exist outside the lifespan"
+    async with server_lifespan(mcp) as state:
+        client = state["http_client"]
+        print(f"Shared client: {client}")
+        assert main._http_client is client
+        # Nested sessions reuse the same pooled client
+        async with server_lifespan(mcp) as nested:
+            assert nested["http_client"] is client
+        assert not client.is_closed, "Client closed while a session was still open"
+    print(f"Client closed after lifespan: {client.is_closed}")
+    assert client.is_closed
+    assert main._http_client is None
+
+@pytest.mark.asyncio
+async def test_weather_tools_use_shared_client():
+    print("\nTesting weather tools reuse the shared client")
+    mock_geocode_response = MagicMock()
+    mock_geocode_response.json.return_value = {
+        "results": [{"name": "Paris", "country": "France", "latitude": 48.85, "longitude": 2.35}]
+    }
+    mock_weather_response = MagicMock()
+    mock_weather_response.json.return_value = {
+        "current": {
+            "temperature_2m": 60,
+            "relative_humidity_2m": 50,
+            "wind_speed_10m": 5,
+            "wind_direction_10m": 90
+        }
+    }
+    mock_weather_response.headers = {}
+
+    async def mock_client_get(url):
+        return mock_geocode_response if "geocoding-api" in url else mock_weather_response
+
+    shared_client = MagicMock()
+    shared_client.get = AsyncMock(side_effect=mock_client_get)
+
+    # A per-call client must not be created while the shared one is available
+    with patch('main._http_client', shared_client), \
+         patch('httpx.AsyncClient', side_effect=AssertionError("per-call client created")):
+        result = await fetch_international_weather("Paris")
+        print(f"Result:\n{result}")
+        assert "Current weather in Paris, France" in result
+        assert shared_client.get.await_count == 2
+
+@pytest.mark.asyncio
+async def test_geocode_cache_survives_restart():
+    print("\nTesting persistent geocode cache")
+    mock_geocode_response = MagicMock()
+    mock_geocode_response.json.return_value = {
+        "results": [{"name": "Tokyo", "country": "Japan", "latitude": 35.68, "longitude": 139.69}]
+    }
+    client = MagicMock()
+    client.get = AsyncMock(return_value=mock_geocode_response)
+
+    location = await main._geocode_international(client, "Tokyo")
+    assert location["name"] == "Tokyo"
+    # Differently formatted spellings share the normalised key
+    await main._geocode_international(client, "  TOKYO ")
+    assert client.get.await_count == 1, "Second lookup should be served from memory"
+
+    # Simulate a restart: the memory front is empty, SQLite still has the entry
+    main._geocode_cache.clear_memory()
+    location = await main._geocode_international(client, "tokyo")
+    print(f"Location after restart: {location}")
+    assert location["latitude"] == 35.68
+    assert client.get.await_count == 1, "Lookup after restart should be served from SQLite"
+
+@pytest.mark.asyncio
+async def test_geocode_cache_negative_entries():
+    print("\nTesting negative geocode caching")
+    mock_geocode_response = MagicMock()
+    mock_geocode_response.json.return_value = {"result": {"addressMatches": []}}
+    client = MagicMock()
+    client.get = AsyncMock(return_value=mock_geocode_response)
+
+    assert await main._geocode_us(client, "Nowhere, ZZ") is None
+    assert await main._geocode_us(client, "nowhere,zz") is None
+    assert client.get.await_count == 1, "Misses should be cached too"
+
+    # Negative entries expire after GEOCODE_NEGATIVE_TTL
+    with patch('main.time.time', return_value=main.time.time() + main.GEOCODE_NEGATIVE_TTL + 1):
+        assert await main._geocode_us(client, "Nowhere, ZZ") is None
+    assert client.get.await_count == 2
+
+@pytest.mark.asyncio
+async def test_nws_points_cached_per_grid_cell():
+    print("\nTesting NWS points cache")
+    mock_points_response = MagicMock()
+    mock_points_response.json.return_value = {
+        "properties": {
+            "forecast": "https://api.weather.gov/gridpoints/SEW/124,67/forecast",
+            "gridId": "SEW", "gridX": 124, "gridY": 67
+        }
+    }
+    client = MagicMock()
+    client.get = AsyncMock(return_value=mock_points_response)
+
+    points = await main._nws_points(client, 47.603832, -122.330062)
+    print(f"Points: {points}")
+    assert points["gridId"] == "SEW"
+    client.get.assert_awaited_once_with("https://api.weather.gov/points/47.6038,-122.3301")
+
+    # Coordinates inside the same rounded cell reuse the cached entry
+    points = await main._nws_points(client, 47.60381, -122.33006)
+    assert points["forecast"].endswith("/forecast")
+    assert client.get.await_count == 1
+
+@pytest.mark.asyncio
+async def test_fetch_US_weather_repeat_city_makes_one_call():
+    print("\nTesting repeat US lookups only hit the forecast endpoint")
+    responses = {
+        "geocoding.geo.census.gov": {"result": {"addressMatches": [{"coordinates": {"x": -122.33, "y": 47.6}}]}},
+        "api.weather.gov/points": {"properties": {"forecast": "https://api.weather.gov/gridpoints/SEW/1,2/forecast"}},
+        "forecast": {"properties": {"periods": [{
+            "temperature": 55, "temperatureUnit": "F", "shortForecast": "Rain",
+            "windSpeed": "5 mph", "windDirection": "S", "detailedForecast": "Rain likely"
+        }]}},
+    }
+    requested = []
+
+    async def mock_client_get(url):
+        requested.append(url)
+        for marker, payload in responses.items():
+            if marker in url:
+                response = MagicMock()
+                response.json.return_value = payload
+                response.headers = {"cache-control": "no-cache"}
+                return response
+        raise ValueError(f"Unexpected URL: {url}")
+
+    client = MagicMock()
+    client.get = AsyncMock(side_effect=mock_client_get)
+    with patch('main._http_client', client):
+        await fetch_US_weather("Seattle, WA")
+        assert len(requested) == 3
+        result = await fetch_US_weather("Seattle, WA")
+    print(f"Requested URLs: {requested}")
+    assert "Temperature: 55°F" in result
+    assert len(requested) == 4 and "gridpoints" in requested[-1], "Repeat lookup should only fetch the forecast"
+
+def _forecast_response(url, status=200, body=None, headers=None):
+    return httpx.Response(status, json=body, headers=headers or {}, request=httpx.Request("GET", url))
+
+@pytest.mark.asyncio
+async def test_forecast_cache_honours_max_age():
+    print("\nTesting forecast cache freshness")
+    url = "https://api.open-meteo.com/v1/forecast?latitude=1&longitude=2"
+    client = MagicMock()
+    client.get = AsyncMock(return_value=_forecast_response(url, body={"current": 1}, headers={"cache-control": "max-age=600"}))
+    cache = main.HttpResponseCache(16, stale_while_revalidate=0)
+
+    assert await cache.get_json(client, url) == {"current": 1}
+    assert await cache.get_json(client, url) == {"current": 1}
+    assert client.get.await_count == 1, "Fresh entry should not be refetched"
+
+    # no-store responses are never cached
+    client.get = AsyncMock(return_value=_forecast_response(url, body={"current": 2}, headers={"cache-control": "no-store"}))
+    cache.clear()
+    await cache.get_json(client, url)
+    await cache.get_json(client, url)
+    assert client.get.await_count == 2
+
+@pytest.mark.asyncio
+async def test_forecast_cache_serves_stale_while_revalidating():
+    print("\nTesting stale-while-revalidate")
+    url = "https://api.weather.gov/gridpoints/SEW/1,2/forecast"
+    client = MagicMock()
+    client.get = AsyncMock(return_value=_forecast_response(url, body={"v": "old"}, headers={"cache-control": "max-age=60, stale-while-revalidate=600"}))
+    cache = main.HttpResponseCache(16, stale_while_revalidate=0)
+    await cache.get_json(client, url)
+
+    client.get = AsyncMock(return_value=_forecast_response(url, body={"v": "new"}, headers={"cache-control": "max-age=60"}))
+    later = main.time.time() + 120
+    with patch('main.time.time', return_value=later), patch('main._http_client', client):
+        result = await cache.get_json(client, url)
+        print(f"Served while stale: {result}")
+        assert result == {"v": "old"}, "Stale entry should be served immediately"
+        await asyncio.gather(*cache._refreshing.values())
+        assert await cache.get_json(client, url) == {"v": "new"}
+    assert client.get.await_count == 1
+
+@pytest.mark.asyncio
+async def test_forecast_cache_default_stale_window_respects_revalidation():
+    print("\nTesting the default stale window is not applied to must-revalidate responses")
+    url = "https://api.weather.gov/gridpoints/SEW/1,2/forecast"
+    cache = main.HttpResponseCache(16, stale_while_revalidate=900)
+    later = main.time.time() + 120
+    for cache_control, served_stale in (("max-age=0, must-revalidate", False), ("max-age=60, must-revalidate", False),
+                                        ("max-age=0", False), ("max-age=60", True)):
+        client = MagicMock()
+        client.get = AsyncMock(return_value=_forecast_response(url, body={"v": "old"}, headers={"cache-control": cache_control}))
+        cache.clear()
+        await cache.get_json(client, url)
+        client.get = AsyncMock(return_value=_forecast_response(url, body={"v": "new"}, headers={"cache-control": "max-age=60"}))
+        with patch('main.time.time', return_value=later), patch('main._http_client', client):
+            result = await cache.get_json(client, url)
+            await asyncio.gather(*cache._refreshing.values())
+        print(f"{cache_control}: {result}")
+        assert (result == {"v": "old"}) == served_stale, cache_control
+
+@pytest.mark.asyncio
+async def test_forecast_cache_conditional_revalidation():
+    print("\nTesting ETag revalidation")
+    url = "https://api.weather.gov/gridpoints/SEW/1,2/forecast"
+    client = MagicMock()
+    client.get = AsyncMock(return_value=_forecast_response(url, body={"v": 1}, headers={
+        "cache-control": "max-age=0", "etag": '"abc"', "last-modified": "Sat, 17 Oct 2026 10:00:00 GMT"
+    }))
+    cache = main.HttpResponseCache(16, stale_while_revalidate=0)
+    await cache.get_json(client, url)
+
+    client.get = AsyncMock(return_value=_forecast_response(url, status=304, headers={"cache-control": "max-age=300"}))
+    result = await cache.get_json(client, url)
+    print(f"Revalidated result: {result}")
+    assert result == {"v": 1}
+    sent = client.get.await_args.kwargs["headers"]
+    assert sent == {"If-None-Match": '"abc"', "If-Modified-Since": "Sat, 17 Oct 2026 10:00:00 GMT"}
+    # The 304 refreshed the freshness lifetime
+    await cache.get_json(client, url)
+    assert client.get.await_count == 1
+
+@pytest.mark.asyncio
+async def test_fetch_weather_batch():
+    print("\nTesting batch weather fetch")
+    calls = []
+    in_flight = 0
+    peak = 0
+
+    async def fake_fetch(city):
+        nonlocal in_flight, peak
+        calls.append(city)
+        in_flight += 1
+        peak = max(peak, in_flight)
+        await asyncio.sleep(0.01)
+        in_flight -= 1
+        if city.startswith("Atlantis"):
+            raise RuntimeError("sunk")
+        return f"Current weather in {city}"
+
+    cities = ["Seattle, WA", "London", "seattle,  wa", "Atlantis", "Paris", "Berlin"]
+    with patch('main.fetch_US_weather', side_effect=fake_fetch) as us, \
+         patch('main.fetch_international_weather', side_effect=fake_fetch) as intl, \
+         patch('main.WEATHER_BATCH_CONCURRENCY', 2):
+        result = await fetch_weather_batch(cities)
+    print(f"Batch result:\n{result}")
+
+    assert us.await_count == 1, "Duplicate US city should be fetched once"
+    assert intl.await_count == 4
+    assert peak <= 2, f"Concurrency limit exceeded: {peak}"
+    blocks = result.split("\n\n")
+    assert [b.splitlines()[0] for b in blocks] == [f"[{i}] {c}" for i, c in enumerate(cities, start=1)]
+    assert "Current weather in Seattle, WA" in blocks[2]
+    assert "Error: RuntimeError: sunk" in blocks[3]
+
+    assert await fetch_weather_batch([]) == "Error: Please provide at least one city"
+
+@pytest.mark.asyncio
+async def test_rate_limiter_paces_upstream_calls():
+    print("\nTesting per-host rate limiter")
+    limiter = main.AsyncRateLimiter(rate=50, burst=2)
+    start = main.time.monotonic()
+    for _ in range(4):
+        await limiter.acquire()
+    elapsed = main.time.monotonic() - start
+    print(f"4 acquisitions at 50/s with burst 2 took {elapsed:.3f}s")
+    # Two go through immediately, the next two wait one interval each
+    assert 0.035 <= elapsed < 0.5
+
+@pytest.mark.asyncio
+async def test_open_meteo_requests_are_coalesced():
+    print("\nTesting Open-Meteo request coalescing")
+    requested = []
+
+    async def mock_client_get(url):
+        requested.append(url)
+        query = httpx.URL(url).params
+        latitudes = query["latitude"].split(",")
+        body = [{"current": {"temperature_2m": float(lat)}} for lat in latitudes]
+        return _forecast_response(url, body=body if len(body) > 1 else body[0])
+
+    client = MagicMock()
+    client.get = AsyncMock(side_effect=mock_client_get)
+    batcher = main.OpenMeteoBatcher(window=0.05, max_batch=10)
+
+    results = await asyncio.gather(
+        batcher.fetch(client, 10.0, 1.0),
+        batcher.fetch(client, 20.0, 2.0),
+        batcher.fetch(client, 10.0, 1.0),
+    )
+    print(f"Requested URLs: {requested}")
+    assert len(requested) == 1, "Concurrent requests should share one upstream call"
+    assert "latitude=10.0,20.0" in requested[0]
+    assert [body["current"]["temperature_2m"] for body, _ in results] == [10.0, 20.0, 10.0]
+
+    # A lone request goes out as a plain single-location call
+    body, _ = await batcher.fetch(client, 30.0, 3.0)
+    assert body["current"]["temperature_2m"] == 30.0
+    assert "latitude=30.0&" in requested[-1]
+
 # Web Crawler Tests
+class FakePooledCrawler:
+    launched = 0
+
+    def __init__(self):
+        FakePooledCrawler.launched += 1
+        self.ready = False
+        self.closed = False
+
+    async def start(self):
+        self.ready = True
+        return self
+
+    async def close(self):
+        self.ready = False
+        self.closed = True
+
+@pytest.mark.asyncio
+async def test_crawler_pool_recycles_browsers():
+    print("\nTesting crawler pool recycling and health checks")
+    FakePooledCrawler.launched = 0
+    with patch('main.AsyncWebCrawler', FakePooledCrawler):
+        pool = main.CrawlerPool(size=1, max_pages_per_browser=2, max_waiters=4, acquire_timeout=1)
+        await pool.start()
+        async with pool.acquire() as first:
+            pass
+        async with pool.acquire() as second:
+            assert second is first, "Browser should be reused until its page budget is spent"
+        assert first.closed, "Browser should be retired after max_pages_per_browser crawls"
+        async with pool.acquire() as third:
+            assert third is not first
+            # Simulate a crashed browser
+            third.ready = False
+        async with pool.acquire() as fourth:
+            assert fourth is not third and fourth.ready
+        print(f"Browsers launched: {FakePooledCrawler.launched}")
+        assert FakePooledCrawler.launched == 3
+        await pool.close()
+        assert fourth.closed
+
+@pytest.mark.asyncio
+async def test_crawler_pool_bounded_wait_queue():
+    print("\nTesting crawler pool wait queue limits")
+    with patch('main.AsyncWebCrawler', FakePooledCrawler):
+        pool = main.CrawlerPool(size=1, max_pages_per_browser=10, max_waiters=1, acquire_timeout=0.05)
+        await pool.start()
+        async with pool.acquire():
+            waiter = asyncio.create_task(pool.acquire().__aenter__())
+            await asyncio.sleep(0)
+            with pytest.raises(main.CrawlerPoolBusy):
+                async with pool.acquire():
+                    pass
+            with pytest.raises(main.CrawlerPoolBusy):
+                await waiter
+        await pool.close()
+
+@pytest.mark.asyncio
+async def test_crawl_tools_use_crawler_pool():
+    print("\nTesting crawl tools lease browsers from the pool")
+    crawler = MagicMock()
+    crawler.arun = AsyncMock(return_value=[MagicMock(success=True, extracted_content=None, html="<p>Pooled page</p>")])
+    pool = MagicMock()
+
+    @main.asynccontextmanager
+    async def acquire():
+        yield crawler
+
+    pool.acquire = acquire
+    with patch('main._crawler_pool', pool), \
+         patch('main.AsyncWebCrawler', side_effect=AssertionError("browser launched per call")):
+        result = await crawl_web_truncated("https://example.com", mode="browser")
+    print(f"Result: {result}")
+    assert result == "Pooled page"
+
+def _pooled_crawler(html, response_headers=None):
+    crawler = MagicMock()
+    crawler.arun = AsyncMock(return_value=[MagicMock(
+        success=True, extracted_content=None, html=html, response_headers=response_headers or {}
+    )])
+    pool = MagicMock()
+
+    @main.asynccontextmanager
+    async def acquire():
+        yield crawler
+
+    pool.acquire = acquire
+    return crawler, pool
+
+@pytest.mark.asyncio
+async def test_large_page_cleaning_keeps_loop_responsive(monkeypatch):
+    print("\nTesting event loop latency while a large page is cleaned")
+    page = "<div><p>Lorem <b>ipsum</b> dolor &amp; sit amet</p><script>var x = 1;</script></div>" * 80_000
+    start = time.perf_counter()
+    expected = clean_and_truncate(page, len(page))
+    inline = time.perf_counter() - start
+
+    with concurrent.futures.ThreadPoolExecutor(1) as executor:
+        monkeypatch.setattr(main, "_clean_executor", executor)
+        job = asyncio.create_task(main._clean_off_loop(page, len(page)))
+        latencies = []
+        while not job.done():
+            start = time.perf_counter()
+            assert (await mcp.call_tool("add", {"a": 2, "b": 3}))
+            latencies.append(time.perf_counter() - start)
+            await asyncio.sleep(0.005)
+        assert await job == expected
+    print(f"Inline cleaning blocks the loop for {inline:.3f}s; "
+          f"offloaded, the slowest of {len(latencies)} add calls took {max(latencies):.3f}s")
+    assert len(latencies) > 1 and max(latencies) < inline / 3, "Tool calls should not wait for the cleaning job"
+
+    # Small jobs stay inline, and worker jobs pickle as a reference to html_cleaning's function
+    monkeypatch.setattr(main, "_clean_executor", MagicMock())
+    assert await main._clean_off_loop("<p>small</p>") == "small"
+    main._clean_executor.submit.assert_not_called()
+    assert pickle.loads(pickle.dumps(main.clean_and_truncate)) is main.clean_and_truncate
+    assert b"html_cleaning" in pickle.dumps(main.clean_main_content)
+
+def test_cleaning_workers_import_only_the_standard_library():
+    print("\nTesting the module cleaning workers import")
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    loaded = subprocess.run(
+        [sys.executable, "-c", "import sys, html_cleaning; print(sorted({'crawl4ai', 'mcp', 'PIL', 'httpx'} & set(sys.modules)))"],
+        cwd=root, capture_output=True, text=True, check=True,
+    ).stdout.strip()
+    assert loaded == "[]", f"Cleaning workers should not load {loaded}"
+
+ARTICLE_PAGE = """<html><head><title>Site</title></head><body>
+<div id="top"><nav><a href="/">Home</a> <a href="/about">About</a></nav></div>
+<div class="cookie-banner">We use cookies, please accept all cookies to keep using this site.</div>
+<div class="layout">
+ <div class="sidebar"><ul><li><a href="/x">Popular one</a></li><li><a href="/y">Popular two, three</a></li></ul></div>
+ <article class="post-content">
+  <h1>The real headline</h1>
+  <p>First paragraph of the article, with commas, clauses, and enough text that it scores well.
+  <div class="share-buttons"><a href="#">Share this</a></div>
+  <p>Second paragraph continues the story, adding detail, nuance, and more sentences of content.</p>
+  <p>Third paragraph wraps things up with a conclusion that also has plenty of words and commas.</p>
+ </article>
+</div>
+<footer>Copyright 2026, all rights reserved, terms, privacy</footer>
+</body></html>"""
+
+def test_clean_main_content():
+    print("\nTesting main-content extraction")
+    result = main.clean_main_content(ARTICLE_PAGE)
+    print(f"Main content: {result}")
+    assert result.startswith("The real headline First paragraph of the article")
+    assert result.endswith("plenty of words and commas.")
+    for boilerplate in ("Home", "cookies", "Popular", "Share this", "Copyright"):
+        assert boilerplate not in result, f"{boilerplate!r} should have been dropped"
+    # Without a clear article the page is cleaned as a whole
+    assert main.clean_main_content("<nav>Menu</nav><p>Short note</p>") == "Menu Short note"
+
+@pytest.mark.asyncio
+async def test_crawl_web_truncated_extract_main():
+    print("\nTesting crawl with extract=main")
+    crawler, pool = _pooled_crawler(ARTICLE_PAGE)
+    with patch('main._crawler_pool', pool):
+        article = await crawl_web_truncated("https://example.com/post", mode="browser", extract="main")
+        full = await crawl_web_truncated("https://example.com/post", mode="browser")
+        assert await crawl_web_truncated("https://example.com/post", mode="browser", extract="main") == article
+    assert article == main.clean_main_content(ARTICLE_PAGE) and len(article) < len(full)
+    assert crawler.arun.await_count == 2, "Each extract mode is cached separately"
+    assert await crawl_web_truncated("https://example.com", extract="best") == "Error: extract must be one of all, main"
+
+def test_normalize_url():
+    print("\nTesting URL normalisation")
+    assert main._normalize_url("HTTPS://Example.COM:443?b=2&a=1#frag") == "https://example.com/?a=1&b=2"
+    assert main._normalize_url("http://example.com:8080/Path/") == "http://example.com:8080/Path/"
+
+@pytest.mark.asyncio
+async def test_crawl_cache_reuses_and_revalidates():
+    print("\nTesting crawl result cache")
+    crawler, pool = _pooled_crawler("<p>Cached page</p>", {"ETag": '"v1"'})
+    with patch('main._crawler_pool', pool):
+        assert await crawl_web_truncated("https://example.com/doc#intro", mode="browser") == "Cached page"
+        # Same document under another spelling of the URL, and via the summarize budget
+        assert await crawl_web_truncated("https://EXAMPLE.com/doc", mode="browser") == "Cached page"
+        text, error = await main._crawl_and_clean("https://example.com/doc", 3000, "browser")
+        assert text == "Cached page" and error is None
+        assert crawler.arun.await_count == 1, "Cached result should be reused within the TTL"
+
+        # Past the TTL a 304 keeps the entry without a browser crawl
+        not_modified = AsyncMock(return_value=True)
+        with patch('main.CRAWL_CACHE_TTL', 0), patch('main._not_modified', not_modified):
+            assert await crawl_web_truncated("https://example.com/doc", mode="browser") == "Cached page"
+        not_modified.assert_awaited_once_with("https://example.com/doc", '"v1"', None)
+        assert crawler.arun.await_count == 1
+
+        # A changed page is crawled again
+        with patch('main.CRAWL_CACHE_TTL', 0), patch('main._not_modified', AsyncMock(return_value=False)):
+            await crawl_web_truncated("https://example.com/doc", mode="browser")
+        assert crawler.arun.await_count == 2
+
+@pytest.mark.asyncio
+async def test_not_modified_sends_validators():
+    print("\nTesting conditional revalidation request")
+    seen = {}
+
+    def handler(request):
+        seen.update(request.headers)
+        return httpx.Response(304 if request.headers.get("if-none-match") == '"v1"' else 200, text="body")
+
+    async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+        with patch('main._http_client', client):
+            assert await main._not_modified("https://example.com/", '"v1"', "Sat, 17 Oct 2026 10:00:00 GMT")
+            assert seen["if-modified-since"] == "Sat, 17 Oct 2026 10:00:00 GMT"
+            assert not await main._not_modified("https://example.com/", '"v2"', None)
+            # Without validators there is nothing to ask
+            assert not await main._not_modified("https://example.com/", None, None)
+
+@pytest.mark.asyncio
+async def test_crawl_http_first_with_browser_fallback():
+    print("\nTesting HTTP-first crawling")
+    article = "<html><head><title>Static</title></head><body><p>" + "Plain server-rendered text. " * 20 + "</p></body></html>"
+    pages = {
+        "/static": httpx.Response(200, html=article),
+        "/spa": httpx.Response(200, html='<html><body><div id="root"></div><script src="/app.js"></script></body></html>'),
+        "/thin": httpx.Response(200, html="<noscript>Please enable JavaScript to view this site.</noscript><p>Loading</p>"),
+    }
+
+    agents = set()
+
+    def handler(request):
+        agents.add(request.headers["user-agent"])
+        if request.url.path.endswith(".pdf"):
+            return httpx.Response(200, content=b"%PDF-1.7", headers={"content-type": "application/pdf"})
+        return pages.get(request.url.path, httpx.Response(404, html="<p>Not found</p>"))
+
+    crawler, pool = _pooled_crawler("<p>Rendered by the browser</p>")
+    # The shared client carries the weather APIs' headers
+    async with httpx.AsyncClient(headers=main.HTTP_HEADERS, transport=httpx.MockTransport(handler)) as client:
+        with patch('main._http_client', client), patch('main._crawler_pool', pool):
+            result = await crawl_web_truncated("https://example.com/static")
+            assert result.startswith("Static Plain server-rendered text."), result
+            assert agents == {main.CRAWL_USER_AGENT}, "Web pages are fetched with the crawl User-Agent"
+            assert crawler.arun.await_count == 0, "Static pages should not start a browser"
+
+            for path in ("/spa", "/thin", "/file.pdf", "/missing"):
+                assert await crawl_web_truncated(f"https://example.com{path}") == "Rendered by the browser", path
+            assert crawler.arun.await_count == 4, "JavaScript shells, non-HTML and errors fall back to the browser"
+
+            # mode="http" never escalates (fresh URLs, the ones above are in the crawl cache now)
+            assert await crawl_web_truncated("https://example.com/gone", mode="http") == "Crawl failed: HTTP 404"
+            assert await crawl_web_truncated("https://example.com/other.pdf", mode="http") == (
+                "Crawl failed: Unsupported content type application/pdf")
+            assert crawler.arun.await_count == 4
+
+            # Asking for the browser renders even when an auto call cached the plain-HTTP text,
+            # and the rendered text then answers later calls of either mode
+            assert await crawl_web_truncated("https://example.com/static", mode="browser") == "Rendered by the browser"
+            assert crawler.arun.await_count == 5, "mode='browser' should not be answered with plain-HTTP text"
+            assert await crawl_web_truncated("https://example.com/static", mode="browser") == "Rendered by the browser"
+            assert await crawl_web_truncated("https://example.com/static") == "Rendered by the browser"
+            assert crawler.arun.await_count == 5
+
+            # Asking for the browser renders even when an auto call cached the plain-HTTP text
+            assert await crawl_web_truncated("https://example.com/static", mode="browser") == "Rendered by the browser"
+            assert crawler.arun.await_count == 5, "mode='browser' should not be answered from the cache"
+    assert await crawl_web_truncated("https://example.com", mode="fast") == "Error: mode must be one of auto, http, browser"
+
+@pytest.mark.asyncio
+async def test_crawl_spools_and_caps_large_pages(monkeypatch, tmp_path):
+    print("\nTesting large downloads are spooled to disk and pages capped")
+    monkeypatch.setattr(main, "CRAWL_SPOOL_BYTES", 2_000)
+    monkeypatch.setattr(main, "CRAWL_MAX_PAGE_BYTES", 20_000)
+    monkeypatch.setattr(main, "CRAWL_SPOOL_DIR", str(tmp_path))
+    page = "<html><body>" + "".join(f"<p>Paragraph {i} of a long page.</p>" for i in range(2_000)) + "</body></html>"
+    capped = clean_and_truncate(page[:20_000], len(page)) + "\n...[truncated]"
+
+    seen = []
+    clean_off_loop = main._clean_off_loop
+
+    async def recording_clean_off_loop(content, max_bytes, extract="all", ctx=None):
+        seen.append(content)
+        return await clean_off_loop(content, max_bytes, extract, ctx)
+
+    monkeypatch.setattr(main, "_clean_off_loop", recording_clean_off_loop)
+    crawler, pool = _pooled_crawler(page)
+    handler = lambda request: httpx.Response(200, html=page)
+    async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+        with patch('main._http_client', client), patch('main._crawler_pool', pool):
+            fetched = await crawl_web_truncated("https://example.com/long", mode="http")
+            rendered = await crawl_web_truncated("https://example.com/rendered", mode="browser")
+    print(f"Cleaned {len(fetched)} characters out of a {len(page)} character page")
+    assert fetched == capped and rendered == capped, "Both paths should stop at CRAWL_MAX_PAGE_BYTES, and say so"
+    assert main._crawl_cache.get("https://example.com/long", main.CRAWL_DOCUMENT_MAX_BYTES + 1) is None, \
+        "A page cut at the cap is not cached as complete"
+    assert [len(content) for content in seen] == [20_000, 20_000]
+    assert isinstance(seen[0], main.SpooledPage), "Large downloads are cleaned from disk"
+    assert seen[1] == page[:20_000], "Rendered pages are already in memory, so they are only cut"
+    assert not list(tmp_path.glob("mcp-crawl-*")), "Spooled pages should be deleted after cleaning"
+
+    # Workers get the path, never the page; only the spooling instance deletes the file
+    spooled = main.SpooledPage()
+    spooled.write(page[:5_000])
+    spooled.finish()
+    copy = pickle.loads(pickle.dumps(spooled))
+    assert len(pickle.dumps(spooled)) < 500 and "".join(copy) == page[:5_000]
+    assert main.clean_main_content(copy) == main.clean_main_content(page[:5_000])
+    del copy
+    assert os.path.exists(spooled.path)
+    spooled.close()
+    assert not os.path.exists(spooled.path)
+
+def test_crawl_documents_page_ascii_text_without_copies():
+    store = main.CrawlDocumentStore(page_bytes=4, max_bytes=100)
+    doc_id, pages = store.put("abcdefghij")
+    assert pages == 3 and store.page(doc_id, 3) == ("ij", 3)
+    # Same ID as hashing the whole encoded text at once
+    assert doc_id == main.hashlib.blake2b(b"abcdefghij", digest_size=8).hexdigest()
+
+def test_crawl_cache_size_bound():
+    print("\nTesting crawl cache LRU eviction")
+    cache = main.CrawlCache()
+    with patch('main.CRAWL_CACHE_MAX_BYTES', 25):
+        cache.put("https://a.example/", "a" * 10, 100)
+        cache.put("https://b.example/", "b" * 10, 100)
+        assert cache.get("https://a.example/", 100) is not None  # a is now most recently used
+        cache.put("https://c.example/", "c" * 10, 100)
+    assert cache.get("https://b.example/", 100) is None, "Least recently used entry should be evicted"
+    assert cache.get("https://a.example/", 100)["text"] == "a" * 10
+    # A truncated entry cannot serve a larger budget
+    cache.put("https://d.example/", "d" * 10 + "\n...[truncated]", 10)
+    assert cache.get("https://d.example/", 10) is not None
+    assert cache.get("https://d.example/", 3000) is None
+
+@pytest.mark.asyncio
+async def test_crawl_many_dedups_and_streams(monkeypatch):
+    print("\nTesting batch crawl")
+    crawled = []
+    batches = []
+    monkeypatch.setattr(main, "CRAWL_MANY_LEASE_PAGES", 2)
+
+    async def arun_many(urls, config=None, dispatcher=None):
+        crawled.extend(urls)
+        batches.append(len(urls))
+        assert config.stream, "Results should be streamed as they finish"
+        assert dispatcher.semaphore_count == main.CRAWL_MANY_CONCURRENCY
+
+        async def finished():
+            # Finish in reverse order
+            for url in reversed(urls):
+                ok = "broken" not in url
+                yield MagicMock(url=url, success=ok, error_message="404", extracted_content=None,
+                                html=f"<p>Page {url[-1]}</p>", response_headers={})
+        return finished()
+
+    crawler, pool = _pooled_crawler("")
+    crawler.arun_many = arun_many
+    main._crawl_cache.put("https://example.com/c", "Cached C", main.MAX_RESULT_BYTES)
+    links = ["https://example.com/a", "https://EXAMPLE.com/a#top", "https://example.com/b",
+             "https://example.com/c", "https://example.com/broken"]
+    with patch('main._crawler_pool', pool):
+        result = await crawl_many(links)
+    print(f"Batch crawl result:\n{result}")
+
+    assert crawled == ["https://example.com/a", "https://example.com/b", "https://example.com/broken"]
+    assert batches == [2, 1], "Each browser lease covers at most CRAWL_MANY_LEASE_PAGES links"
+    sections = result.split("\n\n")
+    assert sections[0] == "[3] https://example.com/c\nCached C", "Cache hits come back first"
+    assert sections[1:] == ["[2] https://example.com/b\nPage b", "[1] https://example.com/a\nPage a",
+                            "[4] https://example.com/broken\nCrawl failed: 404"], "Results stream as each slice finishes"
+    assert await crawl_many([]) == "Error: Please provide at least one link"
+
+def test_simhash_near_duplicates():
+    print("\nTesting SimHash near-duplicate index")
+    words = random.Random(19).choices([f"word{i}" for i in range(3000)], k=1000)
+    article = " ".join(words)
+    mirror = article.replace(words[500], "edited", 1) + " Last updated 18 October 2026."
+    other = " ".join(random.Random(20).choices([f"word{i}" for i in range(3000)], k=1000))
+    distance = (main.simhash(article) ^ main.simhash(mirror)).bit_count()
+    print(f"Mirror distance: {distance}, unrelated distance: {(main.simhash(article) ^ main.simhash(other)).bit_count()}")
+    assert distance <= 7
+
+    index = main.SimHashIndex()
+    assert index.check(article, "original") is None
+    assert index.check(other, "other") is None
+    assert index.check(mirror, "mirror") == "original"
+    assert index.check(article, "again") == "original"
+    assert index.find(main.simhash(article), exclude="original") is None, "A page is not a copy of itself"
+
+    # Bounded indexes drop their oldest labels; re-adding a label replaces its fingerprint
+    bounded = main.SimHashIndex(maxsize=2)
+    bounded.add(main.simhash(article), "a")
+    bounded.add(main.simhash(other), "b")
+    bounded.add(main.simhash(other), "a")
+    assert len(bounded) == 2 and bounded.find(main.simhash(article)) is None
+    bounded.add(main.simhash(article), "c")
+    assert len(bounded) == 2 and bounded.find(main.simhash(other)) == "a", "b was the oldest"
+
+@pytest.mark.asyncio
+async def test_crawl_many_marks_near_duplicates():
+    print("\nTesting near-duplicate marking in batch crawls")
+    body = " ".join(random.Random(11).choices([f"word{i}" for i in range(3000)], k=600))
+
+    async def arun_many(urls, config=None, dispatcher=None):
+        async def finished():
+            for url in urls:
+                html = f"<p>{body} Served by {url}</p>" if "other" not in url else "<p>A completely different page.</p>"
+                yield MagicMock(url=url, success=True, extracted_content=None, html=html, response_headers={})
+        return finished()
+
+    crawler, pool = _pooled_crawler("")
+    crawler.arun_many = arun_many
+    with patch('main._crawler_pool', pool):
+        result = await crawl_many(["https://example.com/?v=1", "https://mirror.example.org/?v=2", "https://example.com/other"])
+    print(f"Batch crawl result:\n{result}")
+    sections = result.split("\n\n")
+    assert sections[1] == "[2] https://mirror.example.org/?v=2\nNear-duplicate of [1] https://example.com/?v=1"
+    assert sections[2] == "[3] https://example.com/other\nA completely different page."
+
+    # Later calls recognise copies of pages returned before, but a page is never a copy of itself
+    with patch('main._crawler_pool', pool):
+        result = await crawl_many(["https://cdn.example.net/?v=3"])
+        again = await crawl_many(["https://example.com/?v=1"])
+    print(f"Repeated batch crawl result:\n{result}")
+    assert result.startswith("[1] https://cdn.example.net/?v=3\n(Near-duplicate of https://example.com/?v=1, crawled earlier)\n"
+                             + body[:100]), "Pages from earlier calls keep their text"
+    assert again.startswith("[1] https://example.com/?v=1\n" + body[:100])
+
+@pytest.mark.asyncio
+async def test_crawl_site_bfs_with_dedup():
+    print("\nTesting bounded site crawl")
+    site = {
+        "https://example.com/": '<title>Home</title><a href="/a">A</a><a href="/b#x">B</a><a href="https://other.org/">Out</a>',
+        "https://example.com/a": '<title>Page A</title><a href="/">Home</a><a href="/c">C</a><a href="/file.pdf">PDF</a>',
+        "https://example.com/b": '<title>Page B</title><a href="https://EXAMPLE.com/a">A again</a>',
+        "https://example.com/c": '<title>Page C</title><a href="/d">D</a>',
+    }
+    crawled = []
+
+    async def arun(url):
+        crawled.append(url)
+        page = url.replace("://www.", "://")
+        return [MagicMock(url=url, success=page in site, error_message="404", extracted_content=None,
+                          html=site.get(page, ""), response_headers={}, links={}, metadata={})]
+
+    crawler, pool = _pooled_crawler("")
+    crawler.arun = arun
+    leases = []
+
+    @main.asynccontextmanager
+    async def acquire():
+        leases.append(crawler)
+        yield crawler
+
+    pool.acquire = acquire
+    with patch('main._crawler_pool', pool):
+        result = await crawl_site("https://example.com", max_pages=10, max_depth=2)
+    print(f"Site crawl result:\n{result}")
+
+    assert sorted(crawled) == sorted(site), "Each page is crawled once; other domains, assets and depth 3 are skipped"
+    assert len(leases) == len(crawled), "Browsers are leased per page, not held by idle workers"
+    assert "1. Home - https://example.com/ (depth 0)" in result
+    assert "Page C - https://example.com/c (depth 2)" in result
+    assert "[2] Page A\nhttps://example.com/a\nPage A" in result
+
+    crawled.clear()
+    with patch('main._crawler_pool', pool):
+        result = await crawl_site("https://example.com/", max_pages=2, max_depth=5, same_domain=False)
+    assert len(crawled) == 2 and result.startswith("Crawled 2 pages"), "max_pages bounds the crawl"
+
+    # Copies of pages from an earlier call are noted, but their text and links still come back
+    crawled.clear()
+    with patch('main._crawler_pool', pool):
+        result = await crawl_site("https://www.example.com/", max_pages=10, max_depth=2)
+    print(f"Mirror crawl result:\n{result}")
+    assert "https://www.example.com/c" in crawled, "Links of a page seen in an earlier call are followed"
+    assert "[1] Home\nhttps://www.example.com/\n(Near-duplicate of https://example.com/, crawled earlier)\n" in result
+    assert "1. Home - https://www.example.com/ (depth 0)\n" in result, "Only copies within the crawl are marked"
+
+    seen = main.SeenURLs()
+    assert seen.add("https://example.com/") and not seen.add("https://example.com/")
+
+@pytest.mark.asyncio
+async def test_crawl_web_truncated_paginates_long_pages(monkeypatch):
+    print("\nTesting paginated crawl documents")
+    store = main.CrawlDocumentStore(page_bytes=16, max_bytes=1000)
+    monkeypatch.setattr(main, "_crawl_documents", store)
+    text = "Lorem ipsum dolor sit amet " * 4
+    crawler, pool = _pooled_crawler(f"<p>{text}</p>")
+    with patch('main._crawler_pool', pool):
+        result = await crawl_web_truncated("https://example.com/long", mode="browser")
+    print(f"First page:\n{result}")
+    first_page, footer = result.split("\n\n")
+    doc_id = footer.split("crawl://")[1].split("/")[0]
+    assert footer == f"[Page 1 of 7. Read the next page from crawl://{doc_id}/2]"
+
+    pages = [first_page]
+    for number in range(2, 8):
+        contents = await mcp.read_resource(f"crawl://{doc_id}/{number}")
+        page, _ = contents[0].content.split("\n\n")
+        pages.append(page)
+    assert "".join(pages) == text.strip(), "Pages rejoin into the full document"
+    assert crawler.arun.await_count == 1, "Reading pages never re-crawls"
+    assert main.get_crawl_page(doc_id, "8").startswith("Error: No page 8")
+
+    # Pages split on UTF-8 character boundaries
+    unicode_id, count = store.put("Café crème brûlée " * 6)
+    unicode_pages = [store.page(unicode_id, n)[0] for n in range(1, count + 1)]
+    assert all(len(page.encode("utf-8")) <= 16 for page in unicode_pages)
+    assert "".join(unicode_pages) == "Café crème brûlée " * 6
+
+    # Least recently used documents are evicted past max_bytes
+    for i in range(20):
+        store.put(f"document {i} " * 10)
+    assert store.page(doc_id, 1) is None and len(store) < 20
+
+@pytest.mark.asyncio
+async def test_crawl_reports_progress_and_partial_text(monkeypatch):
+    print("\nTesting crawl progress and partial results")
+    monkeypatch.setattr(main, "CRAWL_PARTIAL_BYTES", 40)
+    # Several 64 KB chunks of HTML, so the text comes out of the cleaning loop in several pieces
+    crawler, pool = _pooled_crawler("<p>" + "Streaming text arrives early. " * 10_000 + "</p>")
+    ctx = MagicMock()
+    ctx.report_progress = AsyncMock()
+    ctx.log = AsyncMock()
+    with patch('main._crawler_pool', pool):
+        result = await crawl_web_truncated("https://example.com/progress", mode="browser", ctx=ctx)
+    steps = [c.args for c in ctx.report_progress.await_args_list]
+    print(f"Progress: {steps}")
+    assert [(progress, total) for progress, total, _ in steps] == [(0, 2), (1, 2), (2, 2)]
+    partials = [c.args[1] for c in ctx.log.await_args_list]
+    print(f"Partial results: {partials}")
+    assert all(c.args[0] == "info" and c.kwargs == {"logger_name": "crawl.partial"} for c in ctx.log.await_args_list)
+    assert len(partials) > 2 and all(len(text) >= 40 for text in partials), "Text goes out in batches as it is cleaned"
+    first_page = result.split("\n\n[Page 1 of ")[0]
+    assert first_page.startswith("Streaming text arrives early.") and len(first_page) == main.CRAWL_PAGE_BYTES
+    streamed = "".join(partials)
+    assert streamed.startswith(first_page) and len(streamed) > 200_000, "The partials are the page text so far"
+
+    # Batch crawls send each page as it finishes
+    ctx.report_progress.reset_mock()
+    ctx.log.reset_mock()
+    main._crawl_cache.put("https://example.com/a", "Cached A", main.MAX_RESULT_BYTES)
+    main._crawl_cache.put("https://example.com/b", "Cached B", main.MAX_RESULT_BYTES)
+    await crawl_many(["https://example.com/a", "https://example.com/b"], ctx)
+    assert [c.args[1] for c in ctx.log.await_args_list] == ["[1] https://example.com/a\nCached A",
+                                                            "[2] https://example.com/b\nCached B"]
+    assert [c.args[:2] for c in ctx.report_progress.await_args_list] == [(1, 2), (2, 2)]
+
+    # A client that rejects notifications does not break the crawl
+    ctx.report_progress = AsyncMock(side_effect=RuntimeError("no progress token"))
+    with patch('main._crawler_pool', pool):
+        assert await crawl_web_truncated("https://example.com/progress", mode="browser", ctx=ctx) == result
+
+@pytest.mark.asyncio
+async def test_crawl_screenshot_thumbnail():
+    print("\nTesting compact screenshots")
+    import base64
+    import io
+    from PIL import Image as PILImage, ImageDraw
+    # A tall "page" with noisy text-like blocks, as a full-resolution PNG
+    rng = random.Random(21)
+    page = PILImage.new("RGB", (1280, 4800), "white")
+    draw = ImageDraw.Draw(page)
+    for _ in range(2500):
+        x, y = rng.randrange(1240), rng.randrange(4790)
+        draw.rectangle((x, y, x + rng.randrange(4, 40), y + rng.randrange(2, 9)), fill=tuple(rng.choices(range(256), k=3)))
+    png = io.BytesIO()
+    page.save(png, "PNG")
+    print(f"Full screenshot: {png.tell()} bytes")
+
+    crawler, pool = _pooled_crawler("")
+    crawler.arun = AsyncMock(return_value=[MagicMock(success=True, screenshot=base64.b64encode(png.getvalue()).decode())])
+    with patch('main._crawler_pool', pool):
+        for fmt, mime in (("webp", "image/webp"), ("JPG", "image/jpeg")):
+            contents = await mcp.call_tool("crawl_screenshot", {"link": "https://example.com", "max_width": 800, "format": fmt})
+            image = contents[0]
+            data = base64.b64decode(image.data)
+            with PILImage.open(io.BytesIO(data)) as thumbnail:
+                size = thumbnail.size
+            print(f"{fmt}: {len(data)} bytes, {size}")
+            assert image.mimeType == mime
+            assert len(data) <= main.SCREENSHOT_MAX_BYTES and size[0] <= 800
+            assert size[1] <= size[0] * main.SCREENSHOT_MAX_ASPECT + 1, "Very tall captures are cropped"
+        await main.crawl_screenshot("https://EXAMPLE.com/", max_width=800)
+    assert crawler.arun.await_count == 2, "Thumbnails are cached by URL, width and format"
+    assert await main.crawl_screenshot("https://example.com", format="gif") == "Error: format must be one of webp, jpeg"
+
 @pytest.mark.asyncio
 async def test_crawl_web_truncated():
     print("\nTesting web crawler with truncation")
@@ -387,7 +1438,7 @@ async def test_crawl_web_truncated():
     
     with patch('main.AsyncWebCrawler', return_value=crawler):
         print("Crawling example.com...")
-        result = await crawl_web_truncated("https://example.com")
+        result = await crawl_web_truncated("https://example.com", mode="browser")
         print(f"Success case result:\n{result}")
         print("Validating crawled content...")
         assert "Test Page" in result, "Main title not found in crawled content"
@@ -405,10 +1456,67 @@ async def test_crawl_web_truncated():
     error_crawler.arun = AsyncMock(return_value=[mock_error_result])
 
     with patch('main.AsyncWebCrawler', return_value=error_crawler):
-        result = await crawl_web_truncated("https://nonexistent.com")
+        result = await crawl_web_truncated("https://nonexistent.com", mode="browser")
         print(f"Error case result:\n{result}")
         assert "Crawl failed:" in result
 
+@pytest.mark.asyncio
+async def test_summarize_long_page_map_reduce():
+    print("\nTesting map-reduce summarization")
+    sentences = [f"Sentence {i} talks about topic {i % 7} in some detail." for i in range(600)]
+    page = " ".join(sentences)
+    prompts = []
+    active = peak = 0
+
+    async def ask_user(prompt):
+        nonlocal active, peak
+        prompts.append(prompt)
+        active += 1
+        peak = max(peak, active)
+        await asyncio.sleep(0.01)
+        active -= 1
+        return f"Summary {len(prompts)}"
+
+    ctx = MagicMock()
+    ctx.ask_user = ask_user
+    with patch('main._crawl_and_clean', AsyncMock(return_value=(page, None))):
+        result = await crawl_web_summarize_and_truncate("https://example.com/long", ctx)
+    chunks = main._content_chunks(page, main.SUMMARY_CHUNK_BYTES)
+    print(f"{len(chunks)} chunks, peak concurrency {peak}, result: {result}")
+    assert len(chunks) > 1 and all(len(chunk) <= main.SUMMARY_CHUNK_BYTES for chunk in chunks)
+    assert " ".join(chunks) == page, "Chunks cover the whole page"
+    assert len(prompts) == len(chunks) + 1, "One request per chunk plus one merge"
+    assert peak <= main.SUMMARY_CONCURRENCY
+    assert all(any(chunk in prompt for prompt in prompts[:-1]) for chunk in chunks)
+    assert prompts[-1].startswith("The following are summaries") and result == f"Summary {len(prompts)}"
+
+    # Re-summarizing an unchanged page returns the previous summary without asking again
+    prompts.clear()
+    with patch('main._crawl_and_clean', AsyncMock(return_value=(page, None))):
+        assert await crawl_web_summarize_and_truncate("https://EXAMPLE.com/long", ctx) == result
+    assert prompts == []
+
+    # An edit near the start shifts every later offset, yet only the chunks around it are
+    # re-summarized, and their summaries are folded into the previous summary
+    edited = page.replace("Sentence 10 talks", "Sentence 10 now talks")
+    with patch('main._crawl_and_clean', AsyncMock(return_value=(edited, None))):
+        updated = await crawl_web_summarize_and_truncate("https://example.com/long", ctx)
+    print(f"Incremental update took {len(prompts)} requests")
+    assert 1 < len(prompts) <= 3, f"Expected the edited chunk and the update only, got {len(prompts)} requests"
+    assert prompts[-1].startswith("Below is a summary") and f"Current summary:\n{result}" in prompts[-1]
+    assert updated == f"Summary {len(prompts)}"
+
+    # A close copy on the same host reuses the summary instead of summarizing it again...
+    prompts.clear()
+    with patch('main._crawl_and_clean', AsyncMock(return_value=(edited + " Mirrored.", None))):
+        mirrored = await crawl_web_summarize_and_truncate("https://example.com/long?ref=feed", ctx)
+    assert prompts == [] and mirrored == f"(Near-duplicate of https://example.com/long, summarized earlier)\n{updated}"
+
+    # ...but a page on another host is summarized on its own
+    with patch('main._crawl_and_clean', AsyncMock(return_value=(edited + " Mirrored.", None))):
+        other = await crawl_web_summarize_and_truncate("https://mirror.example.org/long", ctx)
+    assert prompts and not other.startswith("(Near-duplicate")
+
 @pytest.mark.asyncio
 async def test_crawl_web_summarize_and_truncate():
     print("\nTesting web crawler with summarization")